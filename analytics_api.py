@@ -4,15 +4,24 @@ Updated to use session authentication instead of password parameter
 """
 
 import os
+import hashlib
 import logging
-from flask import jsonify, request, session
+import tempfile
+import threading
+import zlib
+from collections import OrderedDict
+from flask import Response, jsonify, request, send_file, session, stream_with_context
 from database import db
+from analytics_replica import reports_db, reports_freshness
 from functools import wraps
 
 logger = logging.getLogger(__name__)
 
 ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD", "admin123")
 
+# ✅ RESULT CACHE (dashboard polling): entries per process
+ANALYTICS_CACHE_SIZE = int(os.getenv("ANALYTICS_CACHE_SIZE", 256))
+
 
 def require_admin_session(f):
     """Decorator to require admin session"""
@@ -24,6 +33,117 @@ def require_admin_session(f):
     return decorated_function
 
 
+def gzip_chunks(chunks, level=6):
+    """Compress a byte-chunk stream into one gzip stream on the fly"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31 = gzip container
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def _remove_file(path):
+    if path and os.path.exists(path):
+        os.remove(path)
+
+
+def _export_filters():
+    """date_from / date_to / status query args shared by the export endpoints"""
+    filters = {}
+    for key in ('date_from', 'date_to', 'status'):
+        if request.args.get(key):
+            filters[key] = request.args.get(key)
+    return filters
+
+
+class ResultCache:
+    """
+    LRU of admin API payloads keyed by (endpoint, query args, data_version)
+    Every conversation write bumps data_version, so an entry is reused
+    exactly as long as the data it was computed from is current
+    """
+
+    def __init__(self, max_entries=ANALYTICS_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def get(self, key):
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return payload
+
+    def put(self, key, payload):
+        with self._lock:
+            self._entries[key] = payload
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def metrics(self):
+        """Entries and hit counters (for /health)"""
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified
+        }
+
+
+# Singleton
+result_cache = ResultCache()
+
+
+def cached_json(endpoint, compute):
+    """JSON response of compute(reports) for this request's query args
+
+    Reused until data_version changes. The weak ETag is derived from the
+    same key, so a dashboard polling with If-None-Match gets a bodyless 304
+    until new data lands. "freshness" is added per response (not cached).
+    compute must raise on read errors (raise_errors=True): an error never
+    gets cached or an ETag, the route answers 500 and the next poll retries.
+    """
+    reports = reports_db()
+    key = (endpoint, tuple(sorted(request.args.items(multi=True))),
+           reports.get_data_version())
+    etag = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()[:20]
+
+    if request.if_none_match.contains_weak(etag):
+        result_cache.not_modified += 1
+        response = Response(status=304)
+    else:
+        payload = result_cache.get(key)
+        if payload is None:
+            payload = compute(reports)
+            result_cache.put(key, payload)
+        response = jsonify(dict(payload, freshness=reports_freshness()))
+
+    response.set_etag(etag, weak=True)
+    # Always revalidate (cheap 304) instead of trusting a browser cache lifetime
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def _freshness_headers():
+    """Data source / lag of a file export (JSON responses carry "freshness")"""
+    freshness = reports_freshness()
+    return {
+        'X-Data-Source': freshness['source'],
+        'X-Data-Lag-Seconds': str(freshness['lag_seconds'])
+    }
+
+
 # ==================== ANALYTICS ENDPOINTS ====================
 
 def setup_analytics_routes(app):
@@ -38,6 +158,7 @@ def setup_analytics_routes(app):
         try:
             limit = int(request.args.get('limit', 50))
             offset = int(request.args.get('offset', 0))
+            cursor = request.args.get('cursor')
             tenant_id = request.args.get('tenant_id')
 
             filters = {}
@@ -50,20 +171,29 @@ def setup_analytics_routes(app):
             if request.args.get('keyword'):
                 filters['keyword'] = request.args.get('keyword')
 
-            conversations, total = db.get_conversations(
-                limit=limit,
-                offset=offset,
-                filters=filters,
-                tenant_id=tenant_id
-            )
-
-            return jsonify({
-                "conversations": conversations,
-                "total": total,
-                "limit": limit,
-                "offset": offset,
-                "tenant_id": tenant_id
-            }), 200
+            def compute(reports):
+                page = reports.get_conversations(
+                    limit=limit,
+                    cursor=cursor,
+                    filters=filters,
+                    tenant_id=tenant_id,
+                    offset=offset,
+                    raise_errors=True
+                )
+                return {
+                    "conversations": page["conversations"],
+                    "total": page["total"],
+                    "total_estimated": page["total_estimated"],
+                    "next_cursor": page["next_cursor"],
+                    "limit": limit,
+                    "offset": offset,
+                    "tenant_id": tenant_id
+                }
+
+            try:
+                return cached_json('conversations', compute)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
 
         except Exception as e:
             logger.error(f"❌ Error fetching conversations: {e}")
@@ -76,10 +206,11 @@ def setup_analytics_routes(app):
     @require_admin_session
     def get_conversation_detail(conversation_id):
         try:
-            messages = db.get_conversation_messages(conversation_id)
+            reports = reports_db()
+            messages = reports.get_conversation_messages(conversation_id)
 
             # Get conversation info
-            conn = db.get_connection()
+            conn = reports.get_read_connection()
             cursor = conn.cursor()
             cursor.execute(
                 "SELECT * FROM conversations WHERE id = ?", (conversation_id,))
@@ -87,11 +218,21 @@ def setup_analytics_routes(app):
             conn.close()
 
             if not conv:
-                return jsonify({"error": "Conversation not found"}), 404
+                # Older conversations live in the monthly cold-storage files
+                archived = db.get_archived_conversation(conversation_id)
+                if not archived:
+                    return jsonify({"error": "Conversation not found"}), 404
+                return jsonify({
+                    "conversation": archived["conversation"],
+                    "messages": archived["messages"],
+                    "archived": True,
+                    "archive_month": archived["archive_month"]
+                }), 200
 
             return jsonify({
                 "conversation": dict(conv),
-                "messages": messages
+                "messages": messages,
+                "freshness": reports_freshness()
             }), 200
 
         except Exception as e:
@@ -108,17 +249,24 @@ def setup_analytics_routes(app):
             days = int(request.args.get('days', 30))
             tenant_id = request.args.get('tenant_id')
 
-            stats = db.get_analytics(days=days, tenant_id=tenant_id)
-            daily_stats = db.get_daily_stats(days=days, tenant_id=tenant_id)
-            top_questions = db.get_top_questions(limit=10, tenant_id=tenant_id)
-
-            return jsonify({
-                "stats": stats,
-                "daily_stats": daily_stats,
-                "top_questions": top_questions,
-                "days": days,
-                "tenant_id": tenant_id
-            }), 200
+            questions_days = request.args.get('questions_days', type=int)
+
+            def compute(reports):
+                return {
+                    "stats": reports.get_analytics(
+                        days=days, tenant_id=tenant_id, raise_errors=True),
+                    "daily_stats": reports.get_daily_stats(
+                        days=days, tenant_id=tenant_id, raise_errors=True),
+                    "top_questions": reports.get_top_questions(
+                        limit=10, tenant_id=tenant_id, days=questions_days, raise_errors=True),
+                    "latency": reports.get_latency_stats(
+                        days=days, tenant_id=tenant_id, raise_errors=True),
+                    "questions_days": questions_days,
+                    "days": days,
+                    "tenant_id": tenant_id
+                }
+
+            return cached_json('stats', compute)
 
         except Exception as e:
             logger.error(f"❌ Error fetching analytics stats: {e}")
@@ -130,22 +278,90 @@ def setup_analytics_routes(app):
     @app.route('/api/admin/analytics/export-csv', methods=['GET'])
     @require_admin_session
     def export_csv():
+        """Streamed CSV: ?tenant_id, ?date_from, ?date_to, ?status,
+        ?messages=1 (one row per message), ?gzip=1 (.csv.gz download)"""
         try:
             tenant_id = request.args.get('tenant_id')
-            csv_data = db.export_conversations_csv(tenant_id=tenant_id)
-
-            if not csv_data:
-                return jsonify({"error": "Export failed"}), 500
+            include_messages = request.args.get('messages') in ('1', 'true')
+            use_gzip = request.args.get('gzip') in ('1', 'true')
 
-            return csv_data, 200, {
-                'Content-Disposition': 'attachment; filename=conversations.csv',
-                'Content-Type': 'text/csv'
-            }
+            chunks = reports_db().iter_conversations_csv(
+                filters=_export_filters(),
+                tenant_id=tenant_id,
+                include_messages=include_messages
+            )
+            filename = "conversation_messages.csv" if include_messages else "conversations.csv"
+            mimetype = 'text/csv'
+            if use_gzip:
+                chunks = gzip_chunks(chunks)
+                filename += ".gz"
+                mimetype = 'application/gzip'
+
+            return Response(
+                stream_with_context(chunks),
+                mimetype=mimetype,
+                headers=dict(_freshness_headers(),
+                             **{'Content-Disposition': f'attachment; filename={filename}'})
+            )
 
         except Exception as e:
             logger.error(f"❌ Error exporting CSV: {e}")
             return jsonify({"error": str(e)}), 500
 
+    # ====================
+    # EXPORT PARQUET
+    # ====================
+    @app.route('/api/admin/analytics/export-parquet', methods=['GET'])
+    @require_admin_session
+    def export_parquet():
+        """Typed, columnar export: ?table=conversations|messages, ?tenant_id,
+        ?date_from, ?date_to, ?status"""
+        path = None
+        try:
+            table = request.args.get('table', 'conversations')
+            tenant_id = request.args.get('tenant_id')
+
+            # Written in row groups to a temp file (Parquet footer comes last)
+            with tempfile.NamedTemporaryFile(suffix='.parquet', delete=False) as tmp:
+                path = tmp.name
+            rows = reports_db().export_parquet(
+                path, table=table, filters=_export_filters(), tenant_id=tenant_id)
+            logger.info(f"📦 Parquet export: {rows} {table} rows")
+
+            response = send_file(
+                path,
+                mimetype='application/vnd.apache.parquet',
+                as_attachment=True,
+                download_name=f"{table}.parquet"
+            )
+            response.call_on_close(lambda: os.remove(path))
+            response.headers.update(_freshness_headers())
+            return response
+
+        except ImportError:
+            _remove_file(path)
+            return jsonify({"error": "Parquet export needs pyarrow (pip install pyarrow)"}), 503
+        except ValueError as e:
+            _remove_file(path)
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            _remove_file(path)
+            logger.error(f"❌ Error exporting Parquet: {e}")
+            return jsonify({"error": str(e)}), 500
+
+    # ====================
+    # ARCHIVE MANIFEST
+    # ====================
+    @app.route('/api/admin/analytics/archive', methods=['GET'])
+    @require_admin_session
+    def get_archive_manifest():
+        try:
+            return jsonify(db.archive.load_manifest()), 200
+
+        except Exception as e:
+            logger.error(f"❌ Error reading archive manifest: {e}")
+            return jsonify({"error": str(e)}), 500
+
     # ====================
     # DELETE CONVERSATION
     # ====================
@@ -0,0 +1,124 @@
+"""
+Read-only analytics replica (ANALYTICS_REPLICA_PATH, SQLite only)
+Every ANALYTICS_REPLICA_INTERVAL seconds the primary database is copied into
+the replica file with the SQLite backup API; admin dashboards and exports
+read the copy, so a long export never pins a snapshot (or the WAL) of the
+file chat turns are written to. Unset = admin reads go to the primary
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from database import Database, db
+from db_backends import SQLITE_BUSY_TIMEOUT_MS
+
+logger = logging.getLogger(__name__)
+
+ANALYTICS_REPLICA_PATH = os.getenv("ANALYTICS_REPLICA_PATH")
+ANALYTICS_REPLICA_INTERVAL = int(os.getenv("ANALYTICS_REPLICA_INTERVAL", 60))
+
+
+class AnalyticsReplica:
+    def __init__(self, database, path):
+        self.database = database
+        self.path = path
+        self.reader = None          # Database on the replica (after the first copy)
+        self.refreshed_at = None    # when the copied snapshot was taken
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.refreshes = 0
+        self.failures = 0
+        self.last_refresh_ms = 0.0
+
+    def refresh(self):
+        """Copy the primary into the replica
+
+        One backup step (pages=-1) = one read snapshot of the primary: a
+        stepped backup restarts every time a chat write commits. Readers of
+        the replica keep their snapshot until their transaction ends.
+
+        Returns:
+            bool: True if the replica was refreshed
+        """
+        with self._lock:
+            started = time.perf_counter()
+            snapshot_at = datetime.now()
+            source = self.database.get_read_connection()
+            try:
+                target = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000)
+                try:
+                    # Every refresh rewrites all pages through the replica's WAL;
+                    # shrink it back whenever no export still needs the old pages
+                    target.execute("PRAGMA journal_size_limit=0")
+                    source.backup(target)
+                    target.execute("PRAGMA wal_checkpoint(PASSIVE)")
+                finally:
+                    target.close()
+            except Exception as e:
+                self.failures += 1
+                logger.error(f"❌ Analytics replica refresh failed: {e}")
+                return False
+            finally:
+                source.close()
+
+            if self.reader is None:
+                # Schema already current (copied), so this only opens the pools
+                self.reader = Database(db_path=self.path)
+            self.refreshed_at = snapshot_at
+            self.refreshes += 1
+            self.last_refresh_ms = (time.perf_counter() - started) * 1000
+
+        logger.info(f"📊 Analytics replica refreshed in {self.last_refresh_ms:.0f} ms")
+        return True
+
+    def close(self):
+        if self.reader is not None:
+            self.reader.close()
+
+    def freshness(self):
+        """Where admin reads come from and how old that data is"""
+        if self.reader is None:
+            return {"source": "primary", "refreshed_at": None, "lag_seconds": 0}
+        return {
+            "source": "replica",
+            "refreshed_at": self.refreshed_at.isoformat(),
+            "lag_seconds": round((datetime.now() - self.refreshed_at).total_seconds(), 1)
+        }
+
+    def metrics(self):
+        """Refresh counters + freshness (for /health)"""
+        return dict(self.freshness(), **{
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+            "last_refresh_ms": round(self.last_refresh_ms, 2),
+            "interval_seconds": ANALYTICS_REPLICA_INTERVAL
+        })
+
+
+def reports_db():
+    """Database for admin reads: the replica once it holds a copy, else the primary"""
+    if analytics_replica is not None and analytics_replica.reader is not None:
+        return analytics_replica.reader
+    return db
+
+
+def reports_freshness():
+    if analytics_replica is None:
+        return {"source": "primary", "refreshed_at": None, "lag_seconds": 0}
+    return analytics_replica.freshness()
+
+
+# Singleton (None = disabled, or the primary is PostgreSQL: use a server-side replica there)
+analytics_replica = None
+if ANALYTICS_REPLICA_PATH:
+    if db.backend.name != "sqlite":
+        logger.warning("⚠️ ANALYTICS_REPLICA_PATH ignored - the primary is not SQLite")
+    elif os.path.abspath(ANALYTICS_REPLICA_PATH) == os.path.abspath(db.db_path):
+        logger.error("❌ ANALYTICS_REPLICA_PATH is the primary database - replica disabled")
+    else:
+        analytics_replica = AnalyticsReplica(db, ANALYTICS_REPLICA_PATH)
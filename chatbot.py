@@ -6,11 +6,14 @@ import os
 import re
 import uuid
 import time
+import threading
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 from database import db
 from extended_api import extended_api
 from faq_matcher import FAQMatcher  # ← NOU! Importăm matcher-ul
+from circuit_breaker import get_breaker
+from deadline import Deadline
 
 load_dotenv()
 
@@ -21,16 +24,39 @@ logger = logging.getLogger(__name__)
 # Configure OpenAI
 openai.api_key = os.getenv('OPENAI_API_KEY')
 
+# ⚡ Circuit breaker around GPT calls (fail fast to templated replies)
+openai_breaker = get_breaker(
+    'openai',
+    failure_threshold=int(os.getenv('OPENAI_BREAKER_FAILURES', 3)),
+    slow_call_threshold=float(os.getenv('OPENAI_BREAKER_SLOW_CALL', 10)),
+    reset_timeout=int(os.getenv('OPENAI_BREAKER_RESET', 30))
+)
+
+# ⏱️ Latency budget (seconds) when get_response is called without a deadline
+DEFAULT_BUDGET = float(os.getenv('CHAT_DEADLINE_SECONDS', 20))
+# Minimum budget to still start a GPT call / an API product search
+LLM_TIMEOUT = 15
+LLM_MIN_BUDGET = float(os.getenv('LLM_MIN_BUDGET', 2.0))
+SEARCH_API_MIN_BUDGET = float(os.getenv('SEARCH_API_MIN_BUDGET', 3.0))
+
 
 class ChatBot:
     def __init__(self):
         self.products = []
+        self.product_names = set()
         self.config = {}
+
+        # 🎯 Local catalog index: link -> position in self.products
+        # Generation is bumped by every full reload (feed sync) so API
+        # write-through never overwrites a newer full catalog
+        self.catalog_generation = 0
+        self._product_index = {}
+        self._catalog_lock = threading.Lock()
+
         self.load_products()
         self.load_config()
 
         # 🎯 NEW: Extract all product names (NO HARDCODING!)
-        self.product_names = self.extract_all_product_names()
         logger.info(
             f"✅ Extracted {len(self.product_names)} unique product names")
 
@@ -44,12 +70,15 @@ class ChatBot:
         # 🎯 OPTIMIZATION: Conversation Memory (Strategy 7)
         self.conversation_cache = {}
 
+        # 🎯 OPTIMIZATION: Formatted order replies (order_id -> (order_data, text))
+        self.order_response_cache = {}
+
         logger.info("🤖 ChatBot initialized with optimizations")
 
     def load_products(self):
         """Load products from CSV feed"""
         if not os.path.exists('products.csv'):
-            self.products = []
+            self._swap_catalog([])
             return
 
         try:
@@ -58,10 +87,10 @@ class ChatBot:
             df = pd.read_csv('products.csv', encoding='latin-1')
         except Exception as e:
             logger.error(f"❌ Error reading products.csv: {e}")
-            self.products = []
+            self._swap_catalog([])
             return
 
-        self.products = []
+        products = []
         logger.info(f"📋 CSV Columns found: {list(df.columns)}")
 
         for _, row in df.iterrows():
@@ -94,16 +123,28 @@ class ChatBot:
                              row.get('image_link', ''))).strip()
 
             if name and price > 0:
-                self.products.append(
+                products.append(
                     (name, price, desc, stock, link, image_link))
 
-        logger.info(f"✅ Loaded {len(self.products)} products from feed")
+        self._swap_catalog(products)
+
+        logger.info(
+            f"✅ Loaded {len(self.products)} products from feed (generation {self.catalog_generation})")
 
         if self.products:
             sample = self.products[0]
             logger.info(
                 f"📦 Sample: {sample[0][:30]}, {sample[1]} RON, stock={sample[3]}")
 
+    def _swap_catalog(self, products):
+        """Replace the whole catalog (readers keep iterating the old list)"""
+        with self._catalog_lock:
+            self.products = products
+            self._product_index = {
+                p[4]: i for i, p in enumerate(products) if p[4]}
+            self.catalog_generation += 1
+            self.product_names = self.extract_all_product_names()
+
     def load_config(self):
         try:
             with open('config.json', 'r', encoding='utf-8') as f:
@@ -111,6 +152,59 @@ class ChatBot:
         except Exception:
             self.config = {}
 
+    def merge_api_products(self, api_products, generation):
+        """Write-through: merge Extended API results into the local catalog
+
+        New products are appended and known ones (same link) updated, so the
+        local search sees them before the next feed sync.
+
+        Args:
+            api_products: Products from search_products_exact/fuzzy
+            generation: catalog_generation read before the API call; if a full
+                reload happened meanwhile, the results are dropped
+
+        Returns:
+            int: Number of products added or updated
+        """
+        if not api_products:
+            return 0
+
+        with self._catalog_lock:
+            if generation != self.catalog_generation:
+                logger.info("🔄 Catalog reloaded during API call - skipping merge")
+                return 0
+
+            changes = []
+            for p in api_products:
+                if len(p) < 6:
+                    continue
+                product = tuple(p[:6])
+                name, price, link = product[0], product[1], product[4]
+                if not link or not name or price <= 0:
+                    continue
+                position = self._product_index.get(link)
+                if position is None or self.products[position] != product:
+                    changes.append((position, product))
+
+            if not changes:
+                return 0
+
+            # Copy-on-write so concurrent searches keep a consistent list
+            products = list(self.products)
+            for position, product in changes:
+                if position is None:
+                    self._product_index[product[4]] = len(products)
+                    products.append(product)
+                    base_name = self.extract_base_name(product[0])
+                    if base_name:
+                        self.product_names.add(base_name.lower())
+                else:
+                    products[position] = product
+            self.products = products
+
+        logger.info(f"📥 Merged {len(changes)} API products into local catalog")
+        return len(changes)
+
     # 🎯 NEW: Auto-extract product names (NO HARDCODING!)
     def extract_all_product_names(self):
         """Extract unique product base names from products list
@@ -539,12 +633,17 @@ Detalii:
             return product[3] > 0
         return True
 
-    def search_products_in_stock(self, query, limit=4, category=None, deduplicate=True, exact_match=False):
+    def search_products_in_stock(self, query, limit=4, category=None, deduplicate=True, exact_match=False,
+                                 deadline=None):
         """Search with optional deduplication and advanced filters
 
         Args:
             exact_match: If True, only return products that contain the exact search term
+            deadline: Optional request Deadline - API search is skipped (CSV only)
+                if too little budget remains
         """
+        if deadline is None:
+            deadline = Deadline(DEFAULT_BUDGET)
 
         # 🎯 Extract all filters
         price_range = self.extract_price_range_advanced(query)
@@ -564,18 +663,24 @@ Detalii:
 
         # 🎯 PRIORITY: Try API search first (scalable for 10,000+ products)
         api_results = None
+        catalog_generation = self.catalog_generation
 
-        if exact_match:
+        if not deadline.can_afford(SEARCH_API_MIN_BUDGET):
+            # ⏱️ Not enough budget for a remote search - local catalog only
+            deadline.skip('search_api')
+        elif exact_match:
             # Extract product name for exact search
             query_clean = self._extract_product_name_for_api(query)
             logger.info(f"🔍 Trying API EXACT search for: '{query_clean}'")
 
             # Try API exact search
-            api_results = extended_api.search_products_exact(
-                query=query_clean,
-                limit=limit,
-                category=category
-            )
+            with deadline.stage('search_api'):
+                api_results = extended_api.search_products_exact(
+                    query=query_clean,
+                    limit=limit,
+                    category=category,
+                    deadline=deadline
+                )
         else:
             # Try API fuzzy search
             logger.info(f"🔍 Trying API FUZZY search for: '{query}'")
@@ -583,13 +688,15 @@ Detalii:
             price_min = price_range.get('min') if price_range else None
             price_max = price_range.get('max') if price_range else None
 
-            api_results = extended_api.search_products_fuzzy(
-                query=query,
-                limit=limit * 3,  # Get more for filtering
-                category=category,
-                price_min=price_min,
-                price_max=price_max
-            )
+            with deadline.stage('search_api'):
+                api_results = extended_api.search_products_fuzzy(
+                    query=query,
+                    limit=limit * 3,  # Get more for filtering
+                    category=category,
+                    price_min=price_min,
+                    price_max=price_max,
+                    deadline=deadline
+                )
 
         # 🎯 Extract exact search term FIRST (for both API and CSV)
         exact_search_term = None
@@ -613,6 +720,8 @@ Detalii:
         if api_results is not None and len(api_results) > 0:
             logger.info(f"✅ Using API results: {len(api_results)} products")
             all_results = api_results
+            # 📥 Keep local catalog (CSV fallback) as fresh as the API
+            self.merge_api_products(api_results, catalog_generation)
         else:
             # 🎯 FALLBACK: Use CSV search (backwards compatibility)
             logger.info(f"⚠️ API unavailable - falling back to CSV search")
@@ -620,15 +729,16 @@ Detalii:
             # 🎯 For exact match, search ALL products (no limit) to find all color variants
             search_limit = 9999 if exact_match and exact_search_term else limit * 3
 
-            all_results = self.search_products(
-                query,
-                search_limit,
-                category=category,
-                price_range=price_range,
-                materials=materials,
-                colors=colors,
-                sort_by=sort_by
-            )
+            with deadline.stage('search_local'):
+                all_results = self.search_products(
+                    query,
+                    search_limit,
+                    category=category,
+                    price_range=price_range,
+                    materials=materials,
+                    colors=colors,
+                    sort_by=sort_by
+                )
 
         # 🎯 EXACT MATCH FILTERING (for BOTH API and CSV results)
         if exact_match and exact_search_term and all_results:
@@ -881,9 +991,49 @@ Detalii:
         # Default: if unclear, assume general question
         return False
 
-    def get_response(self, user_message, session_id=None, user_ip=None, user_agent=None):
+    def call_gpt(self, system_prompt, user_message, timeout=LLM_TIMEOUT):
+        """Call GPT-4o-mini through the circuit breaker (caller checked allow_request)"""
+        logger.info("🔄 Calling GPT-4o-mini...")
+        started = time.monotonic()
+
+        try:
+            # 🎯 OPTIMIZATION 6: GPT-4o-mini with appropriate tokens for elegant responses
+            response = openai.chat.completions.create(
+                model="gpt-4o-mini",  # ← 15x CHEAPER than GPT-4o!
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_message}
+                ],
+                max_tokens=300,  # ← Increased for elegant, complete responses
+                temperature=0.7,  # ← Slightly higher for more natural, warm tone
+                timeout=timeout
+            )
+        except openai.APITimeoutError:
+            if timeout < LLM_TIMEOUT:
+                # Cut short by the request deadline - not OpenAI's fault
+                openai_breaker.record_ignored()
+            else:
+                openai_breaker.record_failure()
+            raise
+        except Exception:
+            openai_breaker.record_failure()
+            raise
+
+        openai_breaker.record_success(time.monotonic() - started)
+        logger.info(f"✅ GPT response received")
+        return response.choices[0].message.content
+
+    def get_response(self, user_message, session_id=None, user_ip=None, user_agent=None, deadline=None):
+        """Answer a chat message
+
+        Args:
+            deadline: Request Deadline (created in main.chat); stages that
+                can't finish in time fall back to cheaper answers
+        """
         if not session_id:
             session_id = str(uuid.uuid4())
+        if deadline is None:
+            deadline = Deadline(DEFAULT_BUDGET)
 
         logger.info(f"📩 Chat request: {user_message[:50]}...")
 
@@ -897,7 +1047,8 @@ Detalii:
                 }
 
             # 🎯 OPTIMIZATION 2: FAQ Matcher (Strategy 2) - Check FIRST!
-            cached_response = self.check_faq_cache(user_message)
+            with deadline.stage('faq'):
+                cached_response = self.check_faq_cache(user_message)
             if cached_response:
                 # Obținem și detaliile match-ului pentru logging
                 match_details = self.faq_matcher.get_response(user_message)
@@ -914,7 +1065,10 @@ Detalii:
                     "cached": True,
                     "faq_matched": True,
                     "faq_category": match_details.get('category_id') if match_details else None,
-                    "faq_level": match_details.get('level') if match_details else None
+                    "faq_level": match_details.get('level') if match_details else None,
+                    # Fixed text: stored by reference (popped by main.chat)
+                    "template_id": f"faq:{match_details['category_id']}:{match_details['level']}"
+                    if match_details else "faq"
                 }
 
             # 🎯 ORDER TRACKING: Check if user is asking about order
@@ -922,12 +1076,22 @@ Detalii:
             if order_id:
                 logger.info(f"📦 Order tracking request for order #{order_id}")
 
-                # Fetch order from Extended API
-                order_data = extended_api.get_order_status(order_id)
+                # Fetch order (cached + deduplicated while in flight)
+                with deadline.stage('order_lookup'):
+                    order_data, answered = extended_api.lookup_order(
+                        order_id, deadline=deadline)
 
                 if order_data:
-                    # Format elegant response
-                    order_response = self.format_order_response(order_data)
+                    # Format elegant response (reuse if order data unchanged)
+                    cached_reply = self.order_response_cache.get(order_id)
+                    if cached_reply and cached_reply[0] is order_data:
+                        order_response = cached_reply[1]
+                    else:
+                        order_response = self.format_order_response(order_data)
+                        if len(self.order_response_cache) >= 1000:
+                            self.order_response_cache.clear()
+                        self.order_response_cache[order_id] = (
+                            order_data, order_response)
 
                     # ✅ Conversation saved in main.py (centralized)
                     # db.save_conversation(
@@ -940,6 +1104,33 @@ Detalii:
                         "session_id": session_id,
                         "order_tracking": True
                     }
+                elif extended_api.is_available() and not answered:
+                    # Lookup skipped (budget spent) or timed out - a retry
+                    # will most likely work; don't claim the order is missing
+                    return {
+                        "response": f"""Verificarea comenzii #{order_id} durează mai mult decât de obicei.
+
+Te rog încearcă din nou în câteva momente.
+
+Pentru asistență: 0757 10 51 51 | contact@ejolie.ro""",
+                        "products": [],
+                        "status": "success",
+                        "session_id": session_id,
+                        "fallback": True
+                    }
+                elif not answered:
+                    # API down (circuit open) - don't claim the order is missing
+                    return {
+                        "response": f"""Momentan nu pot verifica statusul comenzii #{order_id}.
+
+Te rog încearcă din nou în câteva minute.
+
+Pentru asistență: 0757 10 51 51 | contact@ejolie.ro""",
+                        "products": [],
+                        "status": "success",
+                        "session_id": session_id,
+                        "fallback": True
+                    }
                 else:
                     # Order not found
                     error_response = f"""Nu am găsit comanda #{order_id}.
@@ -1053,7 +1244,8 @@ Pentru asistență: 0757 10 51 51 | contact@ejolie.ro"""
                 # Don't deduplicate for specific models (show ALL colors!)
                 deduplicate=(not search_for_specific_model),
                 # 🎯 EXACT MATCH for specific products
-                exact_match=search_for_specific_model
+                exact_match=search_for_specific_model,
+                deadline=deadline
             )
 
             # 🎯 OPTIMIZATION 4: Short Product Context (Strategy 3 & 4)
@@ -1129,22 +1321,29 @@ CONTEXT PRODUSE:
 
 Răspunde acum clientei cu eleganță și profesionalism, fără emoji."""
 
-            logger.info("🔄 Calling GPT-4o-mini...")
-
-            # 🎯 OPTIMIZATION 6: GPT-4o-mini with appropriate tokens for elegant responses
-            response = openai.chat.completions.create(
-                model="gpt-4o-mini",  # ← 15x CHEAPER than GPT-4o!
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_message}
-                ],
-                max_tokens=300,  # ← Increased for elegant, complete responses
-                temperature=0.7,  # ← Slightly higher for more natural, warm tone
-                timeout=15
-            )
-
-            bot_response = response.choices[0].message.content
-            logger.info(f"✅ GPT response received")
+            llm_available = deadline.can_afford(LLM_MIN_BUDGET)
+            if not llm_available:
+                deadline.skip('llm')
+
+            if llm_available and openai_breaker.allow_request():
+                with deadline.stage('llm'):
+                    bot_response = self.call_gpt(
+                        system_prompt, user_message,
+                        timeout=deadline.timeout_for(LLM_TIMEOUT))
+                used_fallback = False
+                template_id = None
+            else:
+                # ⚡ OpenAI degraded or out of budget - templated reply
+                logger.warning("⚡ LLM unavailable - using templated reply")
+                if products:
+                    bot_response = self.get_contextual_message(
+                        user_message, category)
+                    template_id = f"contextual:{category}"
+                else:
+                    bot_response = self.faq_matcher.get_fallback_response(
+                        user_message)
+                    template_id = "faq_fallback"
+                used_fallback = True
 
             # Prepare products for frontend
             products_for_frontend = []
@@ -1164,6 +1363,7 @@ Răspunde acum clientei cu eleganță și profesionalism, fără emoji."""
                 if self.user_wants_products(user_message):
                     bot_response = self.get_contextual_message(
                         user_message, category)
+                    template_id = f"contextual:{category}"
                     logger.info(f"✂️ Short response applied: {bot_response}")
                 else:
                     # User asked info question but we found products - use GPT response
@@ -1182,12 +1382,17 @@ Răspunde acum clientei cu eleganță și profesionalism, fără emoji."""
 #                 session_id, user_message, bot_response, user_ip, user_agent, True
 #             )
 
-            return {
+            result = {
                 "response": bot_response,
                 "products": products_for_frontend,
                 "status": "success",
                 "session_id": session_id
             }
+            if used_fallback:
+                result["fallback"] = True
+            if template_id:
+                result["template_id"] = template_id
+            return result
 
         except openai.RateLimitError as e:
             logger.warning(f"⚠️ OpenAI rate limit: {e}")
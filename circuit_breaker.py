@@ -0,0 +1,141 @@
+"""
+Circuit breakers for outbound dependencies (Extended API, OpenAI)
+Open after N consecutive failures or slow calls, fail fast while open,
+let a single probe through after a cool-down (half-open) to detect recovery
+"""
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold=5, slow_call_threshold=None, reset_timeout=30):
+        """
+        Args:
+            name: Dependency name (shown on /health)
+            failure_threshold: Consecutive failures/slow calls before opening
+            slow_call_threshold: Seconds after which a successful call counts as failure
+            reset_timeout: Seconds to stay open before a half-open probe
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.slow_call_threshold = slow_call_threshold
+        self.reset_timeout = reset_timeout
+
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.probe_in_flight = False
+
+        # Counters for monitoring
+        self.total_calls = 0
+        self.total_failures = 0
+        self.total_rejected = 0
+        self.last_failure_at = None
+
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        """Return True if the call may go out, False to fail fast"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                self.total_calls += 1
+                return True
+
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    self.total_rejected += 1
+                    return False
+                self.state = self.HALF_OPEN
+                self.probe_in_flight = False
+                logger.info(f"🟡 Circuit '{self.name}' half-open - probing")
+
+            # HALF_OPEN: only one probe at a time
+            if self.probe_in_flight:
+                self.total_rejected += 1
+                return False
+            self.probe_in_flight = True
+            self.total_calls += 1
+            return True
+
+    def record_success(self, duration=None):
+        """Record a completed call (slow calls count as failures)"""
+        if (self.slow_call_threshold is not None and duration is not None
+                and duration > self.slow_call_threshold):
+            logger.warning(
+                f"🐢 Slow call on '{self.name}': {duration:.1f}s > {self.slow_call_threshold}s")
+            self.record_failure()
+            return
+
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info(f"🟢 Circuit '{self.name}' closed - dependency recovered")
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self.opened_at = None
+            self.probe_in_flight = False
+
+    def record_failure(self):
+        """Record a failed call, opening the circuit if needed"""
+        with self._lock:
+            self.total_failures += 1
+            self.consecutive_failures += 1
+            self.last_failure_at = time.time()
+
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.error(
+                        f"🔴 Circuit '{self.name}' OPEN after {self.consecutive_failures} failures")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self.probe_in_flight = False
+
+    def record_ignored(self):
+        """Call aborted for reasons not attributable to the dependency
+        (e.g. timeout shortened by the request deadline): free the probe slot only"""
+        with self._lock:
+            self.probe_in_flight = False
+
+    def snapshot(self):
+        """Current state for /health"""
+        with self._lock:
+            retry_in = None
+            if self.state == self.OPEN:
+                retry_in = max(0.0, round(
+                    self.reset_timeout - (time.monotonic() - self.opened_at), 1))
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "total_calls": self.total_calls,
+                "total_failures": self.total_failures,
+                "total_rejected": self.total_rejected,
+                "retry_in_seconds": retry_in,
+                "last_failure_at": self.last_failure_at
+            }
+
+
+# Registry (one breaker per dependency)
+_breakers = {}
+_registry_lock = threading.Lock()
+
+
+def get_breaker(name, **kwargs):
+    """Get or create the breaker for a dependency"""
+    with _registry_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name, **kwargs)
+        return _breakers[name]
+
+
+def breakers_snapshot():
+    """State of all breakers (for /health)"""
+    with _registry_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.snapshot() for breaker in breakers}
@@ -0,0 +1,139 @@
+"""
+Cold storage for old conversations
+One append-only gzip JSONL file per month (YYYY-MM.jsonl.gz, one line per
+conversation with its messages) + manifest.json (per-month counts and id
+ranges) so a single conversation can be found without opening every file
+"""
+
+import gzip
+import json
+import logging
+import os
+import threading
+import zlib
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+class ConversationArchive:
+    MANIFEST = "manifest.json"
+
+    def __init__(self, archive_dir):
+        self.archive_dir = archive_dir
+        self._lock = threading.Lock()
+
+    def _path(self, name):
+        return os.path.join(self.archive_dir, name)
+
+    def load_manifest(self):
+        """Manifest dict (empty if nothing archived yet)"""
+        try:
+            with open(self._path(self.MANIFEST), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"months": {}, "total_conversations": 0, "total_messages": 0}
+
+    def _write_manifest(self, manifest):
+        """Atomic replace, readers never see a half-written manifest"""
+        tmp_path = self._path(self.MANIFEST + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._path(self.MANIFEST))
+
+    def append(self, records):
+        """Append conversations to their monthly files
+
+        Args:
+            records: List of {"conversation": row dict, "messages": [row dicts]}
+
+        Returns:
+            list: Months written to
+        """
+        by_month = {}
+        for record in records:
+            month = (record["conversation"].get("start_day") or "unknown")[:7]
+            by_month.setdefault(month, []).append(record)
+
+        with self._lock:
+            os.makedirs(self.archive_dir, exist_ok=True)
+            manifest = self.load_manifest()
+
+            for month, month_records in sorted(by_month.items()):
+                file_name = f"{month}.jsonl.gz"
+                # Each call adds one gzip member; concatenated members are a valid gzip file
+                with open(self._path(file_name), "ab") as f:
+                    with gzip.GzipFile(fileobj=f, mode="wb") as gz:
+                        for record in month_records:
+                            line = {
+                                "id": record["conversation"]["id"],
+                                "conversation": record["conversation"],
+                                "messages": record["messages"]
+                            }
+                            gz.write(json.dumps(line, ensure_ascii=False, default=str).encode("utf-8"))
+                            gz.write(b"\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+
+                ids = [record["conversation"]["id"] for record in month_records]
+                days = [record["conversation"].get("start_day") or "" for record in month_records]
+                entry = manifest["months"].setdefault(month, {
+                    "file": file_name,
+                    "conversations": 0,
+                    "messages": 0,
+                    "min_id": min(ids),
+                    "max_id": max(ids),
+                    "first_day": min(days),
+                    "last_day": max(days)
+                })
+                entry["conversations"] += len(month_records)
+                entry["messages"] += sum(len(record["messages"]) for record in month_records)
+                entry["min_id"] = min(entry["min_id"], min(ids))
+                entry["max_id"] = max(entry["max_id"], max(ids))
+                entry["first_day"] = min(entry["first_day"], min(days))
+                entry["last_day"] = max(entry["last_day"], max(days))
+                entry["bytes"] = os.path.getsize(self._path(file_name))
+                entry["updated_at"] = datetime.now().isoformat(timespec="seconds")
+
+            manifest["total_conversations"] = sum(
+                entry["conversations"] for entry in manifest["months"].values())
+            manifest["total_messages"] = sum(
+                entry["messages"] for entry in manifest["months"].values())
+            manifest["updated_at"] = datetime.now().isoformat(timespec="seconds")
+            self._write_manifest(manifest)
+
+        return sorted(by_month)
+
+    def find_conversation(self, conversation_id):
+        """Look up one archived conversation (admin detail view)
+
+        Only months whose id range contains the id are scanned; lines are
+        matched on their "id" prefix before being parsed
+
+        Returns:
+            dict: {"conversation": ..., "messages": [...], "archive_month": ...} or None
+        """
+        prefix = f'{{"id": {int(conversation_id)},'.encode("utf-8")
+        found = None
+
+        for month, entry in sorted(self.load_manifest()["months"].items()):
+            if not entry["min_id"] <= conversation_id <= entry["max_id"]:
+                continue
+            path = self._path(entry["file"])
+            if not os.path.exists(path):
+                continue
+            try:
+                with gzip.open(path, "rb") as f:
+                    for line in f:
+                        if line.startswith(prefix):
+                            # Last copy wins (a crash between archive and delete re-archives)
+                            found = json.loads(line)
+                            found["archive_month"] = month
+            except (EOFError, gzip.BadGzipFile, zlib.error):
+                logger.warning(f"⚠️ Archive {month} ends with an incomplete gzip member")
+
+        if found:
+            found.pop("id", None)
+        return found
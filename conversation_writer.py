@@ -0,0 +1,204 @@
+"""
+Write-behind conversation logger
+/api/chat enqueues the turn and returns; a background thread writes queued
+turns in batches (one transaction every FLUSH_INTERVAL_MS or BATCH_SIZE turns).
+A batch that hits a transient error (locked database, lost connection) is
+retried with backoff before it is given up
+"""
+
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+from database import db
+
+logger = logging.getLogger(__name__)
+
+WRITER_QUEUE_SIZE = int(os.getenv("WRITER_QUEUE_SIZE", 10000))
+WRITER_FLUSH_INTERVAL_MS = int(os.getenv("WRITER_FLUSH_INTERVAL_MS", 200))
+WRITER_BATCH_SIZE = int(os.getenv("WRITER_BATCH_SIZE", 200))
+WRITER_MAX_ATTEMPTS = int(os.getenv("WRITER_MAX_ATTEMPTS", 5))
+WRITER_RETRY_BACKOFF_MS = int(os.getenv("WRITER_RETRY_BACKOFF_MS", 250))  # doubles per retry
+
+
+class ConversationWriter:
+    def __init__(self, database, max_queue=WRITER_QUEUE_SIZE,
+                 flush_interval_ms=WRITER_FLUSH_INTERVAL_MS, batch_size=WRITER_BATCH_SIZE,
+                 max_attempts=WRITER_MAX_ATTEMPTS, retry_backoff_ms=WRITER_RETRY_BACKOFF_MS):
+        self.database = database
+        self.flush_interval = flush_interval_ms / 1000
+        self.batch_size = batch_size
+        self.max_attempts = max(1, max_attempts)
+        self.retry_backoff = retry_backoff_ms / 1000
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.submitted = 0
+        self.written = 0
+        self.failed = 0
+        self.retries = 0
+        self.sync_fallbacks = 0
+        self.batches = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+        self.last_batch_size = 0
+
+    def start(self):
+        """Start the background writer thread (idempotent)"""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="conversation-writer", daemon=True)
+            self._thread.start()
+        atexit.register(self.stop)
+        logger.info(
+            f"✍️ Conversation writer started (batch {self.batch_size}, every {int(self.flush_interval * 1000)} ms)")
+
+    def submit(self, **turn):
+        """Queue a turn (save_conversation kwargs)
+
+        Returns:
+            bool: True if queued/saved. If the queue is full (or writer not
+            running) the turn is written synchronously instead of dropped;
+            an error there is logged and counted as failed, never raised.
+        """
+        self.submitted += 1
+        if self._thread is not None and self._thread.is_alive():
+            try:
+                self._queue.put_nowait(turn)
+                return True
+            except queue.Full:
+                logger.warning("⚠️ Conversation queue full - writing synchronously")
+
+        self.sync_fallbacks += 1
+        try:
+            # One attempt: this runs on the chat request (no backoff sleeps)
+            saved = self.database.save_conversations_batch([turn])
+        except Exception as e:
+            # The answer was already produced - a failed save must not fail it
+            logger.error(
+                f"❌ Conversation turn dropped (session "
+                f"{str(turn.get('session_id'))[:8]}, synchronous write): {e}")
+            saved = 0
+        self.written += saved
+        self.failed += 1 - saved
+        return saved == 1
+
+    def _run(self):
+        while not self._stopping.is_set() or not self._queue.empty():
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+
+            batch = [first]
+            batch_deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = batch_deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            self._flush(batch)
+
+    def _flush(self, batch):
+        started = time.perf_counter()
+        try:
+            saved = self._write(batch)
+        finally:
+            for _ in batch:
+                self._queue.task_done()
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.written += saved
+        self.failed += len(batch) - saved
+        self.batches += 1
+        self.last_batch_size = len(batch)
+        self.last_flush_ms = elapsed_ms
+        self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+        self.total_flush_ms += elapsed_ms
+
+    def _write(self, batch):
+        """save_conversations_batch, retried with backoff on transient errors
+
+        A failed attempt rolled back as a whole, so retrying cannot save a
+        turn twice. Gives up (and logs the dropped sessions) after
+        max_attempts, or at once on any other error
+
+        Returns:
+            int: Number of turns saved
+        """
+        delay = self.retry_backoff
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                return self.database.save_conversations_batch(batch)
+            except self.database.backend.TRANSIENT_ERRORS as e:
+                error = e
+                if attempt == self.max_attempts:
+                    break
+                self.retries += 1
+                logger.warning(
+                    f"⚠️ Conversation batch write failed ({len(batch)} turns, attempt "
+                    f"{attempt}/{self.max_attempts}): {e} - retrying in {delay * 1000:.0f} ms")
+                time.sleep(delay)
+                delay *= 2
+            except Exception as e:
+                error = e
+                break
+
+        sessions = sorted({str(turn.get("session_id"))[:8] for turn in batch})
+        logger.error(
+            f"❌ Conversation batch dropped ({len(batch)} turns, sessions "
+            f"{', '.join(sessions)}): {error}")
+        return 0
+
+    def flush(self):
+        """Block until everything queued so far is written"""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.join()
+
+    def stop(self, timeout=10):
+        """Flush remaining turns and stop the thread (atexit)"""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join(timeout=timeout)
+        if self._thread.is_alive():
+            logger.warning(
+                f"⚠️ Conversation writer did not finish - {self._queue.qsize()} turns pending")
+        else:
+            logger.info("✅ Conversation writer flushed and stopped")
+        self._thread = None
+
+    def metrics(self):
+        """Queue depth & flush latency (for /health)"""
+        return {
+            "running": bool(self._thread and self._thread.is_alive()),
+            "queue_depth": self._queue.qsize(),
+            "submitted": self.submitted,
+            "written": self.written,
+            "failed": self.failed,
+            "retries": self.retries,
+            "sync_fallbacks": self.sync_fallbacks,
+            "batches": self.batches,
+            "last_batch_size": self.last_batch_size,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+            "avg_flush_ms": round(self.total_flush_ms / self.batches, 2) if self.batches else 0,
+            "max_flush_ms": round(self.max_flush_ms, 2)
+        }
+
+
+# Singleton
+conversation_writer = ConversationWriter(db)
@@ -1,12 +1,25 @@
 import sqlite3
 import os
+import base64
+import bisect
+import json
 import logging
+import threading
+import time
 import uuid
 import csv
+import hashlib
+import html
 import io
+import zlib
 from datetime import datetime, timedelta
 import pytz
 
+from conversation_archive import ConversationArchive
+from db_backends import create_backend
+from tenant_registry import TenantRegistry
+from faq_matcher import normalize_text
+
 logger = logging.getLogger(__name__)
 
 # ✅ SET TIMEZONE TO ROMANIA
@@ -19,217 +32,1183 @@ TZ = pytz.timezone('Australia/Sydney')     # Sydney
 
 DATABASE_PATH = os.getenv("DATABASE_PATH", "chat_database.db")
 
+# ✅ STORAGE BACKEND: SQLite file by default, PostgreSQL when DATABASE_URL is set
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+# ✅ CONVERSATIONS LIST: cached COUNT(*) per filter set (status / keyword filters)
+CONVERSATION_COUNT_TTL = int(os.getenv("CONVERSATION_COUNT_TTL", 60))
+CONVERSATION_COUNT_CACHE_SIZE = 256
+
+# ✅ RETENTION: delete in small transactions, pause so chat writers get the lock
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", 500))
+RETENTION_PAUSE_MS = int(os.getenv("RETENTION_PAUSE_MS", 100))
+VACUUM_PAGES_PER_STEP = int(os.getenv("VACUUM_PAGES_PER_STEP", 2000))
+
+# ✅ COLD STORAGE: monthly .jsonl.gz files for archived conversations
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR")  # default: "archive" next to the database
+
+# ✅ EXPORTS: rows fetched per batch (memory stays flat regardless of export size)
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 2000))
+
+# Parquet row group = one fetch batch (bigger batches compress better)
+PARQUET_BATCH_SIZE = int(os.getenv("PARQUET_BATCH_SIZE", 50000))
+
+# Column types for the Parquet export (pyarrow type names, see _parquet_schema)
+PARQUET_COLUMNS = {
+    "conversations": [
+        ("id", "int64"), ("tenant_id", "category"), ("session_id", "string"),
+        ("user_id", "string"), ("user_name", "string"), ("user_email", "string"),
+        ("user_ip", "string"), ("user_agent", "string"),
+        ("start_time", "timestamp"), ("start_day", "date"), ("end_time", "timestamp"),
+        ("total_messages", "int64"), ("message_count_user", "int64"),
+        ("message_count_bot", "int64"), ("on_topic_count", "int64"),
+        ("off_topic_count", "int64"), ("conversation_duration_seconds", "int64"),
+        ("status", "category"), ("notes", "string"), ("created_at", "timestamp"),
+    ],
+    "messages": [
+        ("id", "int64"), ("conversation_id", "int64"), ("tenant_id", "category"),
+        ("sender", "category"), ("message", "string"), ("message_type", "category"),
+        ("timestamp", "timestamp"), ("response_time_ms", "int64"), ("status", "category"),
+    ],
+}
+
+# ✅ TOP QUESTIONS: question_stats rows under this tenant_id sum every tenant
+# (cross-tenant top-N read from the same index as a single tenant's)
+ALL_TENANTS = "*"
+
+# ✅ FULL-TEXT SEARCH BACKFILL (short write transactions, pause between chunks)
+FTS_BACKFILL_CHUNK = int(os.getenv("FTS_BACKFILL_CHUNK", 5000))
+FTS_BACKFILL_PAUSE_MS = int(os.getenv("FTS_BACKFILL_PAUSE_MS", 50))
+# Until the index is ready, re-read its state this often (seconds): the
+# backfill may finish in another process (or on the primary of a replica)
+FTS_READY_RECHECK = int(os.getenv("FTS_READY_RECHECK", 60))
+
+# ✅ LATENCY HISTOGRAMS (latency_daily bucket upper bounds in ms; one more
+# bucket holds everything slower). p50/p95 are interpolated inside a bucket
+LATENCY_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2000, 3000,
+                      5000, 8000, 12000, 20000, 30000, 60000)
+
+# ✅ BOT MESSAGE STORAGE: template/FAQ replies are stored as a reference to
+# response_templates, long free-text replies zlib-compressed (SQLite only -
+# PostgreSQL compresses large text itself). 0 disables compression
+MESSAGE_COMPRESS_MIN_BYTES = int(os.getenv("MESSAGE_COMPRESS_MIN_BYTES", 512))
+MESSAGE_COMPRESS_LEVEL = int(os.getenv("MESSAGE_COMPRESS_LEVEL", 6))
+
+
+def fts_match_query(keyword):
+    """Admin keyword -> FTS5 MATCH expression
+
+    Every term is quoted (no FTS operator injection) and prefix-matched,
+    so "rochi" finds rochie/rochii. Returns None if nothing is searchable.
+    """
+    terms = [term.replace('"', '""') for term in (keyword or "").split()
+             if any(ch.isalnum() for ch in term)]
+    if not terms:
+        return None
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+def mark_snippet(snippet):
+    """FTS snippet (matches between char(2) and char(3)) -> HTML-escaped text with
+    <mark> tags (messages come from the public widget: never raw HTML)"""
+    if snippet is None:
+        return None
+    return html.escape(snippet).replace("\x02", "<mark>").replace("\x03", "</mark>")
+
+
+def encode_cursor(conversation):
+    """Opaque keyset cursor for the row after which the next page starts"""
+    raw = json.dumps([conversation['start_time'], conversation['id']])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Cursor -> (start_time, id); ValueError if it was not issued by us"""
+    try:
+        start_time, conversation_id = json.loads(
+            base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return str(start_time), int(conversation_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def question_hash(normalized):
+    """Stable key for a normalized user question"""
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+
+
+def latency_bucket(ms):
+    """latency_daily bucket for a duration in ms"""
+    return bisect.bisect_left(LATENCY_BUCKETS_MS, ms)
+
+
+def histogram_percentile(counts, fraction):
+    """Approximate percentile (ms) of a {bucket: count} latency histogram"""
+    total = sum(counts.values())
+    if total <= 0:
+        return None
+    rank = fraction * total
+    seen = 0
+    for bucket in sorted(counts):
+        count = counts[bucket]
+        if count <= 0:
+            continue
+        if seen + count >= rank:
+            if bucket >= len(LATENCY_BUCKETS_MS):
+                return LATENCY_BUCKETS_MS[-1]
+            lower = LATENCY_BUCKETS_MS[bucket - 1] if bucket else 0
+            upper = LATENCY_BUCKETS_MS[bucket]
+            return int(lower + (upper - lower) * (rank - seen) / count)
+        seen += count
+    return LATENCY_BUCKETS_MS[-1]
+
+
+def timing_stages(timing_json):
+    """Stage -> ms from a conversation_messages.timing_json value"""
+    if not timing_json:
+        return {}
+    try:
+        return dict(json.loads(timing_json).get("stages") or {})
+    except (ValueError, AttributeError):
+        return {}
+
 
 class Database:
     """
     Handle all database operations for chatbot
     analytics-safe, multi-tenant ready, magic-link auth ready
-    Auto-syncs products from feed on startup if needed
+    Schema is versioned (PRAGMA user_version) and migrated on startup
+    Storage is SQLite by default, PostgreSQL with DATABASE_URL (db_backends)
     """
 
-    def __init__(self):
-        self.db_path = DATABASE_PATH
-        self.init_db()
-        # ✅ Auto-migrate: Add user info columns if missing
-        self._migrate_user_info_columns()
-        # ✅ Auto-sync from feed on startup
-        self.ensure_initial_sync()
+    # Numbered schema migrations, applied in order by migrate().
+    # Every step is idempotent so databases created before versioning
+    # (user_version 0, schema partly or fully present) upgrade safely.
+    # Append new steps at the end - never renumber or edit shipped ones.
+    MIGRATIONS = (
+        (1, "_migration_base_schema"),
+        (2, "_migration_day_bucket"),
+        (3, "_migration_analytics_rollups"),
+        (4, "_migration_message_search_index"),
+        (5, "_migration_composite_indexes"),
+        (6, "_migration_latency_rollups"),
+        (7, "_migration_message_references"),
+        (8, "_migration_reindex_encoded_replies"),
+        (9, "_migration_all_tenant_questions"),
+    )
+    SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+    # PostgreSQL has no pre-versioning history: it starts at the current schema
+    # (version kept in db_meta 'schema_version')
+    POSTGRES_MIGRATIONS = (
+        (1, "_pg_migration_base_schema"),
+        (2, "_pg_migration_latency_rollups"),
+        (3, "_pg_migration_message_references"),
+        (4, "_migration_all_tenant_questions"),
+    )
+
+    def __init__(self, db_path=None, auto_sync=False, database_url=None):
+        self.db_path = db_path or DATABASE_PATH
+        # ✅ Long-lived connections (writes + read-only analytics); an explicit
+        # db_path means a local SQLite file (tools/benchmarks), not DATABASE_URL
+        self.backend = create_backend(
+            self.db_path, database_url or (None if db_path else DATABASE_URL))
+        self.archive = ConversationArchive(ARCHIVE_DIR or os.path.join(
+            os.path.dirname(os.path.abspath(self.db_path)), "archive"))
+        # api_key -> tenant, in memory (loaded on first use / by main.py at startup)
+        self.tenants = TenantRegistry(self)
+        # Keyword search: FTS5 when available and backfilled, LIKE otherwise
+        # (None = not checked yet, see _check_search_index)
+        self.fts_enabled = None
+        self.fts_ready = False
+        self._fts_recheck_at = 0
+        # response_templates id -> body (rows are immutable, see _template_bodies)
+        self._templates = {}
+        # (tenant, filters) -> (total, expires_at) for filters rollups can't answer
+        self._count_cache = {}
+        self._count_lock = threading.Lock()
+        # ✅ Schema migrations (one PRAGMA read when already current)
+        self.migrate()
+        # Feed sync is a scheduler job in main.py; scripts may still ask for it here
+        if auto_sync:
+            self.ensure_initial_sync()
+
+    # =========================
+    # SCHEMA MIGRATIONS
+    # =========================
+    def _migrations(self):
+        return self.MIGRATIONS if self.backend.name == "sqlite" else self.POSTGRES_MIGRATIONS
 
-    def _migrate_user_info_columns(self):
-        """Add user_id, user_name, user_email columns if they don't exist"""
+    def get_schema_version(self):
+        """Current schema version (PRAGMA user_version on SQLite)"""
+        conn = self.get_connection()
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
+            return self.backend.schema_version(conn.cursor())
+        finally:
+            conn.close()
 
-            # Check existing columns
-            cursor.execute("PRAGMA table_info(conversations)")
-            existing_columns = [row[1] for row in cursor.fetchall()]
+    def migrate(self):
+        """Apply pending migrations, each in its own write transaction
 
-            logger.info(
-                f"📋 Checking conversations table columns: {existing_columns}")
+        The version is re-read under the write lock, so several workers
+        starting at once apply every step exactly once.
 
-            # Add missing columns
-            if 'user_id' not in existing_columns:
-                logger.info("➕ Adding user_id column to conversations table")
-                cursor.execute(
-                    "ALTER TABLE conversations ADD COLUMN user_id TEXT")
-                logger.info("✅ user_id column added")
+        Returns:
+            int: Schema version after migrating
+        """
+        migrations = self._migrations()
+        target = migrations[-1][0]
+        version = self.get_schema_version()
+        if version >= target:
+            return version
 
-            if 'user_name' not in existing_columns:
-                logger.info("➕ Adding user_name column to conversations table")
-                cursor.execute(
-                    "ALTER TABLE conversations ADD COLUMN user_name TEXT")
-                logger.info("✅ user_name column added")
+        started = time.perf_counter()
+        logger.info(
+            f"📋 Database schema v{version} -> v{target} ({self.backend.name}), migrating...")
 
-            if 'user_email' not in existing_columns:
-                logger.info(
-                    "➕ Adding user_email column to conversations table")
+        for number, name in migrations:
+            if number <= version:
+                continue
+            conn = self.get_connection()
+            try:
+                cursor = conn.cursor()
+                cursor.execute("BEGIN IMMEDIATE")
+                self.backend.lock_schema(cursor)
+                if self.backend.schema_version(cursor) < number:
+                    getattr(self, name)(cursor)
+                    self.backend.set_schema_version(cursor, number)
+                conn.commit()
+                logger.info(f"✅ Migration {number} ({name}) applied")
+            except Exception as e:
+                logger.error(f"❌ Migration {number} ({name}) failed: {e}")
+                raise
+            finally:
+                conn.close()
+            version = number
+
+        logger.info(
+            f"✅ Database schema at v{version} ({time.perf_counter() - started:.1f}s)")
+        return version
+
+    def _add_missing_columns(self, cursor, table, columns):
+        """ALTER TABLE ADD COLUMN for each (name, type) not yet in table"""
+        cursor.execute(f"PRAGMA table_info({table})")
+        existing_columns = {row[1] for row in cursor.fetchall()}
+        for name, column_type in columns:
+            if name not in existing_columns:
+                logger.info(f"➕ Adding {name} column to {table} table")
                 cursor.execute(
-                    "ALTER TABLE conversations ADD COLUMN user_email TEXT")
-                logger.info("✅ user_email column added")
+                    f"ALTER TABLE {table} ADD COLUMN {name} {column_type}")
+
+    def _migration_base_schema(self, cursor):
+        """v1: core tables + columns added by the old ad-hoc migrations
+        (users.password_hash from migrate_db.py, conversations.user_*)"""
+        # =========================
+        # TENANTS
+        # =========================
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS tenants (
+                id TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                domain TEXT,
+                api_key TEXT UNIQUE NOT NULL,
+                plan TEXT DEFAULT 'free',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+
+        # =========================
+        # USERS (PASSWORD LOGIN)
+        # =========================
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                id TEXT PRIMARY KEY,
+                email TEXT UNIQUE NOT NULL,
+                password_hash TEXT,
+                role TEXT NOT NULL DEFAULT 'client',
+                tenant_id TEXT,
+                login_token TEXT,
+                token_expiry TIMESTAMP,
+                is_active INTEGER DEFAULT 1,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        self._add_missing_columns(cursor, "users", [("password_hash", "TEXT")])
+
+        # =========================
+        # CONVERSATIONS
+        # =========================
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS conversations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                tenant_id TEXT DEFAULT 'default',
+                session_id TEXT UNIQUE NOT NULL,
+                user_id TEXT,
+                user_name TEXT,
+                user_email TEXT,
+                user_ip TEXT,
+                user_agent TEXT,
+                start_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                start_day TEXT,
+                end_time TIMESTAMP,
+                total_messages INTEGER DEFAULT 0,
+                message_count_user INTEGER DEFAULT 0,
+                message_count_bot INTEGER DEFAULT 0,
+                on_topic_count INTEGER DEFAULT 0,
+                off_topic_count INTEGER DEFAULT 0,
+                conversation_duration_seconds INTEGER DEFAULT 0,
+                status TEXT DEFAULT 'active',
+                notes TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        self._add_missing_columns(cursor, "conversations", [
+            ("user_id", "TEXT"), ("user_name", "TEXT"), ("user_email", "TEXT")])
+
+        # =========================
+        # CONVERSATION MESSAGES
+        # =========================
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS conversation_messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                conversation_id INTEGER NOT NULL,
+                sender TEXT NOT NULL,
+                message TEXT NOT NULL,
+                message_type TEXT DEFAULT 'text',
+                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                response_time_ms INTEGER,
+                status TEXT DEFAULT 'success',
+                FOREIGN KEY(conversation_id)
+                    REFERENCES conversations(id)
+                    ON DELETE CASCADE
+            )
+        """)
+
+        # =========================
+        # ANALYTICS CACHE
+        # =========================
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS analytics (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                date DATE UNIQUE NOT NULL,
+                total_conversations INTEGER DEFAULT 0,
+                total_messages INTEGER DEFAULT 0,
+                avg_messages_per_conversation REAL DEFAULT 0,
+                on_topic_percentage REAL DEFAULT 0,
+                off_topic_percentage REAL DEFAULT 0,
+                avg_response_time_ms INTEGER DEFAULT 0,
+                unique_sessions INTEGER DEFAULT 0,
+                last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+
+        # =========================
+        # SYNC LOG (for tracking feed syncs)
+        # =========================
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS sync_log (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                tenant_id TEXT DEFAULT 'default',
+                sync_type TEXT DEFAULT 'feed',
+                last_sync TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                products_count INTEGER DEFAULT 0,
+                status TEXT DEFAULT 'success',
+                error_message TEXT,
+                FOREIGN KEY(tenant_id) REFERENCES tenants(id)
+            )
+        """)
+
+        # =========================
+        # INDEXES
+        # =========================
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_conversations_start_time ON conversations(start_time)")
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_conversations_status ON conversations(status)")
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON conversation_messages(timestamp)")
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_users_email ON users(email)")
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_users_token ON users(login_token)")
+
+        # =========================
+        # DEFAULT TENANT (sync_log references tenants with foreign_keys=ON)
+        # =========================
+        cursor.execute("""
+            INSERT OR IGNORE INTO tenants (id, name, api_key)
+            VALUES ('default', 'Default', ?)
+        """, (str(uuid.uuid4()),))
 
-            conn.commit()
-            conn.close()
+    def _migration_day_bucket(self, cursor):
+        """v2: conversations.start_day (YYYY-MM-DD, indexed) for date filters"""
+        self._add_missing_columns(cursor, "conversations", [("start_day", "TEXT")])
+        cursor.execute("""
+            UPDATE conversations SET start_day = DATE(start_time)
+            WHERE start_day IS NULL AND start_time IS NOT NULL
+        """)
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_conversations_start_day ON conversations(start_day)")
+
+    def _migration_analytics_rollups(self, cursor):
+        """v3: daily rollups, question counters and db_meta, built from history"""
+        # =========================
+        # DAILY ROLLUPS (maintained by the write path)
+        # =========================
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS analytics_daily (
+                day TEXT NOT NULL,
+                tenant_id TEXT NOT NULL DEFAULT 'default',
+                conversations INTEGER DEFAULT 0,
+                messages INTEGER DEFAULT 0,
+                on_topic INTEGER DEFAULT 0,
+                off_topic INTEGER DEFAULT 0,
+                unique_sessions INTEGER DEFAULT 0,
+                response_time_sum_ms INTEGER DEFAULT 0,
+                response_time_count INTEGER DEFAULT 0,
+                last_updated TIMESTAMP,
+                PRIMARY KEY (day, tenant_id)
+            ) WITHOUT ROWID
+        """)
+
+        # =========================
+        # TOP QUESTIONS (normalized question counters)
+        # =========================
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS question_stats (
+                tenant_id TEXT NOT NULL DEFAULT 'default',
+                question_hash TEXT NOT NULL,
+                message TEXT NOT NULL,
+                count INTEGER DEFAULT 0,
+                last_seen TIMESTAMP,
+                PRIMARY KEY (tenant_id, question_hash)
+            ) WITHOUT ROWID
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS question_stats_daily (
+                day TEXT NOT NULL,
+                tenant_id TEXT NOT NULL DEFAULT 'default',
+                question_hash TEXT NOT NULL,
+                count INTEGER DEFAULT 0,
+                PRIMARY KEY (day, tenant_id, question_hash)
+            ) WITHOUT ROWID
+        """)
+
+        # =========================
+        # DB META (backfill / maintenance state)
+        # =========================
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS db_meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        """)
+
+        # Backfill on first upgrade with existing history
+        cursor.execute("SELECT 1 FROM conversations LIMIT 1")
+        if cursor.fetchone() is None:
+            return
+        cursor.execute("SELECT 1 FROM analytics_daily LIMIT 1")
+        if cursor.fetchone() is None:
+            logger.info("➕ Building daily analytics rollups from history")
+            self._rebuild_analytics_rollups(cursor)
+        cursor.execute("SELECT 1 FROM question_stats LIMIT 1")
+        if cursor.fetchone() is None:
+            logger.info("➕ Building question counters from history")
+            self._rebuild_question_stats(cursor)
+
+    def _migration_message_search_index(self, cursor):
+        """v4: FTS5 index on conversation_messages + sync triggers
+
+        Triggers index every message written from now on; older messages
+        (id <= fts_backfill_upto) are indexed by backfill_message_search_index()
+        """
+        # unicode61 + remove_diacritics: "rosie" matches "roșie"/"roşie"
+        try:
+            cursor.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS conversation_messages_fts USING fts5(
+                    message,
+                    conversation_id UNINDEXED,
+                    tokenize = 'unicode61 remove_diacritics 2'
+                )
+            """)
+        except sqlite3.OperationalError as e:
+            # Nothing else to do without FTS5; keyword search stays on LIKE
+            logger.warning(f"⚠️ FTS5 unavailable ({e}) - keyword search falls back to LIKE")
+            return
 
-            logger.info("✅ User info columns migration completed")
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS conversation_messages_fts_ai
+            AFTER INSERT ON conversation_messages BEGIN
+                INSERT INTO conversation_messages_fts (rowid, message, conversation_id)
+                VALUES (new.id, new.message, new.conversation_id);
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS conversation_messages_fts_ad
+            AFTER DELETE ON conversation_messages BEGIN
+                DELETE FROM conversation_messages_fts WHERE rowid = old.id;
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS conversation_messages_fts_au
+            AFTER UPDATE OF message ON conversation_messages BEGIN
+                DELETE FROM conversation_messages_fts WHERE rowid = old.id;
+                INSERT INTO conversation_messages_fts (rowid, message, conversation_id)
+                VALUES (new.id, new.message, new.conversation_id);
+            END
+        """)
+
+        # Messages above this id are covered by the triggers (same transaction)
+        cursor.execute("""
+            INSERT OR IGNORE INTO db_meta (key, value)
+            SELECT 'fts_backfill_upto', COALESCE(MAX(id), 0) FROM conversation_messages
+        """)
+
+    def _migration_composite_indexes(self, cursor):
+        """v5: indexes shaped after the queries (check: db_tools.py check-plans)"""
+        # tenant filter + ORDER BY start_time DESC, id DESC (id = rowid, implicit)
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_conversations_tenant_start ON conversations(tenant_id, start_time)")
+        # Detail view: WHERE conversation_id = ? ORDER BY timestamp
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_messages_conversation_time ON conversation_messages(conversation_id, timestamp)")
+        # Per-sender work (bot response times, user questions) grouped by conversation
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_messages_sender_conversation ON conversation_messages(sender, conversation_id)")
+        # Last sync per tenant: WHERE tenant_id = ? ORDER BY last_sync DESC
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_sync_log_tenant_sync ON sync_log(tenant_id, last_sync)")
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_question_stats_count ON question_stats(tenant_id, count DESC)")
+        # Per-tenant rollup sums (the primary key leads with day)
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_analytics_daily_tenant ON analytics_daily(tenant_id, day)")
+
+        # Prefixes of the composite indexes above (extra write cost, no reads)
+        cursor.execute("DROP INDEX IF EXISTS idx_conversations_tenant_id")
+        cursor.execute("DROP INDEX IF EXISTS idx_messages_conversation_id")
+        cursor.execute("DROP INDEX IF EXISTS idx_sync_log_tenant_id")
+
+    def _pg_migration_base_schema(self, cursor):
+        """PostgreSQL v1: the SQLite schema at v5 (same tables, columns, indexes)
+
+        Timestamps default to LOCALTIMESTAMP (local clock, like the values
+        the app writes); no FTS index - keyword search uses ILIKE
+        """
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS tenants (
+                id TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                domain TEXT,
+                api_key TEXT UNIQUE NOT NULL,
+                plan TEXT DEFAULT 'free',
+                created_at TIMESTAMP DEFAULT LOCALTIMESTAMP
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                id TEXT PRIMARY KEY,
+                email TEXT UNIQUE NOT NULL,
+                password_hash TEXT,
+                role TEXT NOT NULL DEFAULT 'client',
+                tenant_id TEXT,
+                login_token TEXT,
+                token_expiry TIMESTAMP,
+                is_active INTEGER DEFAULT 1,
+                created_at TIMESTAMP DEFAULT LOCALTIMESTAMP
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS conversations (
+                id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+                tenant_id TEXT DEFAULT 'default',
+                session_id TEXT UNIQUE NOT NULL,
+                user_id TEXT,
+                user_name TEXT,
+                user_email TEXT,
+                user_ip TEXT,
+                user_agent TEXT,
+                start_time TIMESTAMP DEFAULT LOCALTIMESTAMP,
+                start_day TEXT,
+                end_time TIMESTAMP,
+                total_messages INTEGER DEFAULT 0,
+                message_count_user INTEGER DEFAULT 0,
+                message_count_bot INTEGER DEFAULT 0,
+                on_topic_count INTEGER DEFAULT 0,
+                off_topic_count INTEGER DEFAULT 0,
+                conversation_duration_seconds INTEGER DEFAULT 0,
+                status TEXT DEFAULT 'active',
+                notes TEXT,
+                created_at TIMESTAMP DEFAULT LOCALTIMESTAMP
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS conversation_messages (
+                id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+                conversation_id BIGINT NOT NULL
+                    REFERENCES conversations(id) ON DELETE CASCADE,
+                sender TEXT NOT NULL,
+                message TEXT NOT NULL,
+                message_type TEXT DEFAULT 'text',
+                timestamp TIMESTAMP DEFAULT LOCALTIMESTAMP,
+                response_time_ms INTEGER,
+                status TEXT DEFAULT 'success'
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS analytics (
+                id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+                date DATE UNIQUE NOT NULL,
+                total_conversations INTEGER DEFAULT 0,
+                total_messages INTEGER DEFAULT 0,
+                avg_messages_per_conversation REAL DEFAULT 0,
+                on_topic_percentage REAL DEFAULT 0,
+                off_topic_percentage REAL DEFAULT 0,
+                avg_response_time_ms INTEGER DEFAULT 0,
+                unique_sessions INTEGER DEFAULT 0,
+                last_updated TIMESTAMP DEFAULT LOCALTIMESTAMP
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS analytics_daily (
+                day TEXT NOT NULL,
+                tenant_id TEXT NOT NULL DEFAULT 'default',
+                conversations BIGINT DEFAULT 0,
+                messages BIGINT DEFAULT 0,
+                on_topic BIGINT DEFAULT 0,
+                off_topic BIGINT DEFAULT 0,
+                unique_sessions BIGINT DEFAULT 0,
+                response_time_sum_ms BIGINT DEFAULT 0,
+                response_time_count BIGINT DEFAULT 0,
+                last_updated TIMESTAMP,
+                PRIMARY KEY (day, tenant_id)
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS question_stats (
+                tenant_id TEXT NOT NULL DEFAULT 'default',
+                question_hash TEXT NOT NULL,
+                message TEXT NOT NULL,
+                count BIGINT DEFAULT 0,
+                last_seen TIMESTAMP,
+                PRIMARY KEY (tenant_id, question_hash)
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS question_stats_daily (
+                day TEXT NOT NULL,
+                tenant_id TEXT NOT NULL DEFAULT 'default',
+                question_hash TEXT NOT NULL,
+                count BIGINT DEFAULT 0,
+                PRIMARY KEY (day, tenant_id, question_hash)
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS db_meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS sync_log (
+                id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+                tenant_id TEXT DEFAULT 'default' REFERENCES tenants(id),
+                sync_type TEXT DEFAULT 'feed',
+                last_sync TIMESTAMP DEFAULT LOCALTIMESTAMP,
+                products_count INTEGER DEFAULT 0,
+                status TEXT DEFAULT 'success',
+                error_message TEXT
+            )
+        """)
+
+        for statement in (
+            "CREATE INDEX IF NOT EXISTS idx_conversations_start_time ON conversations(start_time)",
+            "CREATE INDEX IF NOT EXISTS idx_conversations_tenant_start ON conversations(tenant_id, start_time)",
+            "CREATE INDEX IF NOT EXISTS idx_conversations_start_day ON conversations(start_day)",
+            "CREATE INDEX IF NOT EXISTS idx_conversations_status ON conversations(status)",
+            "CREATE INDEX IF NOT EXISTS idx_messages_conversation_time ON conversation_messages(conversation_id, timestamp)",
+            "CREATE INDEX IF NOT EXISTS idx_messages_sender_conversation ON conversation_messages(sender, conversation_id)",
+            "CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON conversation_messages(timestamp)",
+            "CREATE INDEX IF NOT EXISTS idx_users_email ON users(email)",
+            "CREATE INDEX IF NOT EXISTS idx_users_token ON users(login_token)",
+            "CREATE INDEX IF NOT EXISTS idx_sync_log_tenant_sync ON sync_log(tenant_id, last_sync)",
+            "CREATE INDEX IF NOT EXISTS idx_question_stats_count ON question_stats(tenant_id, count DESC)",
+            "CREATE INDEX IF NOT EXISTS idx_analytics_daily_tenant ON analytics_daily(tenant_id, day)",
+        ):
+            cursor.execute(statement)
 
-        except Exception as e:
-            logger.warning(f"⚠️ Migration warning: {e}")
-            logger.warning("📝 Conversations will be saved without user info")
+        cursor.execute("""
+            INSERT INTO tenants (id, name, api_key)
+            VALUES ('default', 'Default', ?)
+            ON CONFLICT (id) DO NOTHING
+        """, (str(uuid.uuid4()),))
+
+    def _migration_latency_rollups(self, cursor):
+        """v6: per-stage timing breakdown on bot messages + daily latency histograms"""
+        self._add_missing_columns(cursor, "conversation_messages", [("timing_json", "TEXT")])
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS latency_daily (
+                day TEXT NOT NULL,
+                tenant_id TEXT NOT NULL DEFAULT 'default',
+                stage TEXT NOT NULL,
+                bucket INTEGER NOT NULL,
+                count INTEGER DEFAULT 0,
+                PRIMARY KEY (day, tenant_id, stage, bucket)
+            ) WITHOUT ROWID
+        """)
+        self._backfill_latency_rollups(cursor)
+
+    def _pg_migration_latency_rollups(self, cursor):
+        """PostgreSQL v2: same as SQLite v6"""
+        cursor.execute(
+            "ALTER TABLE conversation_messages ADD COLUMN IF NOT EXISTS timing_json TEXT")
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS latency_daily (
+                day TEXT NOT NULL,
+                tenant_id TEXT NOT NULL DEFAULT 'default',
+                stage TEXT NOT NULL,
+                bucket INTEGER NOT NULL,
+                count BIGINT DEFAULT 0,
+                PRIMARY KEY (day, tenant_id, stage, bucket)
+            )
+        """)
+        self._backfill_latency_rollups(cursor)
+
+    def _migration_message_references(self, cursor):
+        """v7: response_templates + encoded bot message bodies
+
+        A bot message has exactly one of: message (inline text),
+        template_ref (response_templates row) or body_zlib (compressed
+        text); message is '' for the two encoded forms
+        """
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS response_templates (
+                id INTEGER PRIMARY KEY,
+                template_id TEXT NOT NULL,
+                version TEXT NOT NULL,
+                body TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE (template_id, version)
+            )
+        """)
+        self._add_missing_columns(cursor, "conversation_messages", [
+            ("template_ref", "INTEGER REFERENCES response_templates(id)"),
+            ("body_zlib", "BLOB"),
+        ])
+
+    def _migration_reindex_encoded_replies(self, cursor):
+        """v8: search index text for template/compressed bot replies
+
+        Before v8 only compressed replies had their text put in the FTS
+        index; template replies were indexed as ''
+        """
+        cursor.execute("""
+            SELECT 1 FROM sqlite_master
+            WHERE type = 'table' AND name = 'conversation_messages_fts'
+        """)
+        if cursor.fetchone() is None:
+            return
+        cursor.execute("""
+            UPDATE conversation_messages_fts SET message = (
+                SELECT COALESCE(t.body, inflate(m.body_zlib), m.message)
+                FROM conversation_messages m
+                LEFT JOIN response_templates t ON t.id = m.template_ref
+                WHERE m.id = conversation_messages_fts.rowid
+            )
+            WHERE rowid IN (
+                SELECT id FROM conversation_messages
+                WHERE template_ref IS NOT NULL OR body_zlib IS NOT NULL
+            )
+        """)
+
+    def _migration_all_tenant_questions(self, cursor):
+        """v9 (PostgreSQL v4): ALL_TENANTS question counters, from the per-tenant ones"""
+        # A fresh database already got them from the v3 backfill (rebuild)
+        cursor.execute("DELETE FROM question_stats WHERE tenant_id = ?", (ALL_TENANTS,))
+        cursor.execute("""
+            INSERT INTO question_stats (tenant_id, question_hash, message, count, last_seen)
+            SELECT ?, question_hash, MIN(message), SUM(count), MAX(last_seen)
+            FROM question_stats
+            WHERE tenant_id != ?
+            GROUP BY question_hash
+        """, (ALL_TENANTS, ALL_TENANTS))
+
+    def _pg_migration_message_references(self, cursor):
+        """PostgreSQL v3: same as SQLite v7 (body_zlib stays empty: copy-to-postgres
+        inflates compressed SQLite rows into message)"""
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS response_templates (
+                id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+                template_id TEXT NOT NULL,
+                version TEXT NOT NULL,
+                body TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT LOCALTIMESTAMP,
+                UNIQUE (template_id, version)
+            )
+        """)
+        cursor.execute("""
+            ALTER TABLE conversation_messages
+                ADD COLUMN IF NOT EXISTS template_ref BIGINT REFERENCES response_templates(id),
+                ADD COLUMN IF NOT EXISTS body_zlib BYTEA
+        """)
 
-    def get_connection(self):
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        return conn
+    def _backfill_latency_rollups(self, cursor):
+        """Histograms for response times stored before latency_daily existed"""
+        cursor.execute("""
+            SELECT 1 FROM conversation_messages
+            WHERE sender = 'bot' AND response_time_ms IS NOT NULL LIMIT 1
+        """)
+        if cursor.fetchone() is None:
+            return
+        cursor.execute("SELECT 1 FROM latency_daily LIMIT 1")
+        if cursor.fetchone() is None:
+            logger.info("➕ Building latency histograms from history")
+            self._rebuild_latency_rollups(cursor)
+
+    def rebuild_analytics_rollups(self):
+        """Recompute analytics_daily from conversations (backfill / repair)
+        Days already pruned by cleanup_old_conversations are lost on rebuild
+
+        Returns:
+            int: Number of (day, tenant) rollup rows written
+        """
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            written = self._rebuild_analytics_rollups(cursor)
+            self._bump_data_version(cursor)
+            conn.commit()
+            logger.info(f"✅ Rebuilt {written} daily analytics rollups")
+            return written
+        finally:
+            conn.close()
 
-    # =========================
-    # INIT DB
-    # =========================
-    def init_db(self):
+    def _rebuild_analytics_rollups(self, cursor):
+        """rebuild_analytics_rollups inside the caller's transaction"""
+        cursor.execute("DELETE FROM analytics_daily")
+        cursor.execute("""
+            INSERT INTO analytics_daily
+            (day, tenant_id, conversations, messages, on_topic, off_topic,
+             unique_sessions, response_time_sum_ms, response_time_count, last_updated)
+            SELECT
+                c.start_day,
+                COALESCE(c.tenant_id, 'default'),
+                COUNT(*),
+                SUM(c.total_messages),
+                SUM(c.on_topic_count),
+                SUM(c.off_topic_count),
+                COUNT(DISTINCT c.session_id),
+                COALESCE(SUM(rt.sum_ms), 0),
+                COALESCE(SUM(rt.cnt), 0),
+                ?
+            FROM conversations c
+            LEFT JOIN (
+                SELECT conversation_id, SUM(response_time_ms) as sum_ms, COUNT(*) as cnt
+                FROM conversation_messages
+                WHERE sender = 'bot' AND response_time_ms IS NOT NULL
+                GROUP BY conversation_id
+            ) rt ON rt.conversation_id = c.id
+            WHERE c.start_day IS NOT NULL
+            GROUP BY c.start_day, COALESCE(c.tenant_id, 'default')
+        """, (datetime.now(),))
+        return cursor.rowcount
+
+    def rebuild_question_stats(self):
+        """Recompute question_stats / question_stats_daily from user messages
+
+        Returns:
+            int: Number of distinct (tenant, question) counters written
+        """
+        conn = self.get_connection()
         try:
-            conn = self.get_connection()
             cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            written = self._rebuild_question_stats(cursor)
+            self._bump_data_version(cursor)
+            conn.commit()
+            logger.info(f"✅ Rebuilt {written} question counters")
+            return written
+        finally:
+            conn.close()
 
-            # =========================
-            # TENANTS
-            # =========================
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS tenants (
-                    id TEXT PRIMARY KEY,
-                    name TEXT NOT NULL,
-                    domain TEXT,
-                    api_key TEXT UNIQUE NOT NULL,
-                    plan TEXT DEFAULT 'free',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
+    def _rebuild_question_stats(self, cursor):
+        """rebuild_question_stats inside the caller's transaction"""
+        if self.backend.name != "sqlite":
+            return self._rebuild_question_stats_streamed(cursor)
+        # Same normalization as the write path, evaluated inside SQLite
+        cursor.connection.create_function(
+            "normalize_text", 1, normalize_text, deterministic=True)
+        cursor.connection.create_function(
+            "question_hash", 1, question_hash, deterministic=True)
+        cursor.execute("DELETE FROM question_stats")
+        cursor.execute("DELETE FROM question_stats_daily")
+        cursor.execute("""
+            CREATE TEMP TABLE question_backfill AS
+            SELECT COALESCE(c.tenant_id, 'default') as tenant_id,
+                   question_hash(normalize_text(m.message)) as question_hash,
+                   normalize_text(m.message) as normalized,
+                   m.message as message,
+                   m.timestamp as timestamp
+            FROM conversation_messages m
+            JOIN conversations c ON c.id = m.conversation_id
+            WHERE m.sender = 'user'
+        """)
+        cursor.execute("""
+            INSERT INTO question_stats (tenant_id, question_hash, message, count, last_seen)
+            SELECT tenant_id, question_hash, MIN(message), COUNT(*), MAX(timestamp)
+            FROM question_backfill
+            WHERE normalized != ''
+            GROUP BY tenant_id, question_hash
+        """)
+        written = cursor.rowcount
+        cursor.execute("""
+            INSERT INTO question_stats (tenant_id, question_hash, message, count, last_seen)
+            SELECT ?, question_hash, MIN(message), COUNT(*), MAX(timestamp)
+            FROM question_backfill
+            WHERE normalized != ''
+            GROUP BY question_hash
+        """, (ALL_TENANTS,))
+        # Message timestamps are UTC (CURRENT_TIMESTAMP), day buckets are local
+        cursor.execute("""
+            INSERT INTO question_stats_daily (day, tenant_id, question_hash, count)
+            SELECT DATE(timestamp, 'localtime'), tenant_id, question_hash, COUNT(*)
+            FROM question_backfill
+            WHERE normalized != ''
+            GROUP BY DATE(timestamp, 'localtime'), tenant_id, question_hash
+        """)
+        cursor.execute("DROP TABLE question_backfill")
+        return written
+
+    def _rebuild_question_stats_streamed(self, cursor):
+        """Same as _rebuild_question_stats, normalizing in Python (backends
+        without Python SQL functions); counters are bulk-loaded with COPY"""
+        cursor.execute("DELETE FROM question_stats")
+        cursor.execute("DELETE FROM question_stats_daily")
+
+        totals = {}
+        daily = {}
+        stream = self.backend.stream_cursor(cursor.connection)
+        stream.execute(f"""
+            SELECT COALESCE(c.tenant_id, 'default'), m.message, m.timestamp,
+                   {self.backend.local_day('m.timestamp')}
+            FROM conversation_messages m
+            JOIN conversations c ON c.id = m.conversation_id
+            WHERE m.sender = 'user'
+        """)
+        while True:
+            rows = stream.fetchmany(EXPORT_BATCH_SIZE)
+            if not rows:
+                break
+            for tenant_id, message, timestamp, day in rows:
+                normalized = normalize_text(message)
+                if not normalized:
+                    continue
+                key = (tenant_id, question_hash(normalized))
+                entry = totals.get(key)
+                if entry is None:
+                    totals[key] = [message, 1, timestamp]
+                else:
+                    entry[0] = min(entry[0], message)
+                    entry[1] += 1
+                    entry[2] = max(entry[2], timestamp)
+                daily[(day,) + key] = daily.get((day,) + key, 0) + 1
+        stream.close()
+
+        all_tenants = {}
+        for (_, key), (message, count, last_seen) in totals.items():
+            entry = all_tenants.get(key)
+            if entry is None:
+                all_tenants[key] = [message, count, last_seen]
+            else:
+                entry[0] = min(entry[0], message)
+                entry[1] += count
+                entry[2] = max(entry[2], last_seen)
+
+        self.backend.copy_rows(
+            cursor, "question_stats",
+            ("tenant_id", "question_hash", "message", "count", "last_seen"),
+            [key + tuple(entry) for key, entry in totals.items()]
+            + [(ALL_TENANTS, key) + tuple(entry) for key, entry in all_tenants.items()])
+        self.backend.copy_rows(
+            cursor, "question_stats_daily",
+            ("day", "tenant_id", "question_hash", "count"),
+            (key + (count,) for key, count in daily.items()))
+        return len(totals)
+
+    def rebuild_latency_rollups(self):
+        """Recompute latency_daily from bot message timings
+
+        Returns:
+            int: Number of (day, tenant, stage, bucket) rows written
+        """
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            written = self._rebuild_latency_rollups(cursor)
+            self._bump_data_version(cursor)
+            conn.commit()
+            logger.info(f"✅ Rebuilt {written} latency histogram buckets")
+            return written
+        finally:
+            conn.close()
 
-            # =========================
-            # USERS (PASSWORD LOGIN)
-            # =========================
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    id TEXT PRIMARY KEY,
-                    email TEXT UNIQUE NOT NULL,
-                    password_hash TEXT,
-                    role TEXT NOT NULL DEFAULT 'client',
-                    tenant_id TEXT,
-                    login_token TEXT,
-                    token_expiry TIMESTAMP,
-                    is_active INTEGER DEFAULT 1,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
+    def _rebuild_latency_rollups(self, cursor):
+        """rebuild_latency_rollups inside the caller's transaction
+        (timing_json is parsed in Python, so one streamed pass on every backend).
+        Day = the conversation's start day, as in analytics_daily"""
+        cursor.execute("DELETE FROM latency_daily")
+
+        counts = {}
+        stream = self.backend.stream_cursor(cursor.connection)
+        stream.execute(f"""
+            SELECT COALESCE(c.tenant_id, 'default'), m.response_time_ms, m.timing_json,
+                   COALESCE(c.start_day, {self.backend.local_day('m.timestamp')})
+            FROM conversation_messages m
+            JOIN conversations c ON c.id = m.conversation_id
+            WHERE m.sender = 'bot'
+              AND (m.response_time_ms IS NOT NULL OR m.timing_json IS NOT NULL)
+        """)
+        while True:
+            rows = stream.fetchmany(EXPORT_BATCH_SIZE)
+            if not rows:
+                break
+            for tenant_id, response_time_ms, timing_json, day in rows:
+                for stage, ms in self._latency_samples(
+                        response_time_ms, timing_stages(timing_json)):
+                    key = (day, tenant_id, stage, latency_bucket(ms))
+                    counts[key] = counts.get(key, 0) + 1
+        stream.close()
+
+        self.backend.copy_rows(
+            cursor, "latency_daily", ("day", "tenant_id", "stage", "bucket", "count"),
+            (key + (count,) for key, count in counts.items()))
+        return len(counts)
+
+    def _check_search_index(self):
+        """Set fts_enabled / fts_ready from the database (first keyword search,
+        then every FTS_READY_RECHECK seconds while not ready)"""
+        if self.backend.name != "sqlite":
+            self.fts_enabled = self.fts_ready = False
+            return False
+        first_check = self.fts_enabled is None
+        self._fts_recheck_at = time.monotonic() + FTS_READY_RECHECK
+        conn = self.get_read_connection()
+        try:
+            self.fts_enabled = conn.execute("""
+                SELECT 1 FROM sqlite_master
+                WHERE type = 'table' AND name = 'conversation_messages_fts'
+            """).fetchone() is not None
+        finally:
+            conn.close()
+        self.fts_ready = self.fts_enabled and (
+            self._get_meta('fts_backfill_through', 0) >= self._get_meta('fts_backfill_upto', 0))
+        if first_check and self.fts_enabled and not self.fts_ready:
+            logger.info("📝 Message search index needs backfill - keyword search uses LIKE until done")
+        return self.fts_ready
+
+    def backfill_message_search_index(self, chunk_size=FTS_BACKFILL_CHUNK,
+                                      pause_ms=FTS_BACKFILL_PAUSE_MS):
+        """Index messages written before the FTS table existed
+
+        One short BEGIN IMMEDIATE per chunk (chat writers interleave between
+        chunks); progress is stored in db_meta so it resumes after a restart.
+
+        Returns:
+            int: Number of messages indexed
+        """
+        if self.fts_enabled is None:
+            self._check_search_index()
+        if not self.fts_enabled or self.fts_ready:
+            return 0
 
-            # =========================
-            # CONVERSATIONS
-            # =========================
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS conversations (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    tenant_id TEXT DEFAULT 'default',
-                    session_id TEXT UNIQUE NOT NULL,
-                    user_id TEXT,
-                    user_name TEXT,
-                    user_email TEXT,
-                    user_ip TEXT,
-                    user_agent TEXT,
-                    start_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    end_time TIMESTAMP,
-                    total_messages INTEGER DEFAULT 0,
-                    message_count_user INTEGER DEFAULT 0,
-                    message_count_bot INTEGER DEFAULT 0,
-                    on_topic_count INTEGER DEFAULT 0,
-                    off_topic_count INTEGER DEFAULT 0,
-                    conversation_duration_seconds INTEGER DEFAULT 0,
-                    status TEXT DEFAULT 'active',
-                    notes TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
+        upto = self._get_meta('fts_backfill_upto', 0)
+        through = self._get_meta('fts_backfill_through', 0)
+        indexed = 0
+        started = time.perf_counter()
 
-            # =========================
-            # CONVERSATION MESSAGES
-            # =========================
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS conversation_messages (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    conversation_id INTEGER NOT NULL,
-                    sender TEXT NOT NULL,
-                    message TEXT NOT NULL,
-                    message_type TEXT DEFAULT 'text',
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    response_time_ms INTEGER,
-                    status TEXT DEFAULT 'success',
-                    FOREIGN KEY(conversation_id)
-                        REFERENCES conversations(id)
-                        ON DELETE CASCADE
-                )
-            """)
+        while through < upto:
+            conn = self.get_connection()
+            try:
+                cursor = conn.cursor()
+                cursor.execute("BEGIN IMMEDIATE")
+                cursor.execute("""
+                    SELECT MAX(id) FROM (
+                        SELECT id FROM conversation_messages
+                        WHERE id > ? AND id <= ?
+                        ORDER BY id LIMIT ?
+                    )
+                """, (through, upto, chunk_size))
+                chunk_end = cursor.fetchone()[0] or upto
 
-            # =========================
-            # ANALYTICS CACHE
-            # =========================
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS analytics (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    date DATE UNIQUE NOT NULL,
-                    total_conversations INTEGER DEFAULT 0,
-                    total_messages INTEGER DEFAULT 0,
-                    avg_messages_per_conversation REAL DEFAULT 0,
-                    on_topic_percentage REAL DEFAULT 0,
-                    off_topic_percentage REAL DEFAULT 0,
-                    avg_response_time_ms INTEGER DEFAULT 0,
-                    unique_sessions INTEGER DEFAULT 0,
-                    last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
+                cursor.execute("""
+                    INSERT INTO conversation_messages_fts (rowid, message, conversation_id)
+                    SELECT m.id, m.message, m.conversation_id
+                    FROM conversation_messages m
+                    WHERE m.id > ? AND m.id <= ?
+                      AND NOT EXISTS (
+                        SELECT 1 FROM conversation_messages_fts f WHERE f.rowid = m.id
+                      )
+                """, (through, chunk_end))
+                indexed += cursor.rowcount
+                self._set_meta(cursor, 'fts_backfill_through', chunk_end)
+                conn.commit()
+            finally:
+                conn.close()
 
-            # =========================
-            # SYNC LOG (for tracking feed syncs)
-            # =========================
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS sync_log (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    tenant_id TEXT DEFAULT 'default',
-                    sync_type TEXT DEFAULT 'feed',
-                    last_sync TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    products_count INTEGER DEFAULT 0,
-                    status TEXT DEFAULT 'success',
-                    error_message TEXT,
-                    FOREIGN KEY(tenant_id) REFERENCES tenants(id)
-                )
-            """)
+            through = chunk_end
+            if pause_ms:
+                time.sleep(pause_ms / 1000)
 
-            # =========================
-            # INDEXES
-            # =========================
-            cursor.execute(
-                "CREATE INDEX IF NOT EXISTS idx_conversations_start_time ON conversations(start_time)")
-            cursor.execute(
-                "CREATE INDEX IF NOT EXISTS idx_conversations_tenant_id ON conversations(tenant_id)")
-            cursor.execute(
-                "CREATE INDEX IF NOT EXISTS idx_conversations_status ON conversations(status)")
-            cursor.execute(
-                "CREATE INDEX IF NOT EXISTS idx_messages_conversation_id ON conversation_messages(conversation_id)")
-            cursor.execute(
-                "CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON conversation_messages(timestamp)")
-            cursor.execute(
-                "CREATE INDEX IF NOT EXISTS idx_users_email ON users(email)")
-            cursor.execute(
-                "CREATE INDEX IF NOT EXISTS idx_users_token ON users(login_token)")
-            cursor.execute(
-                "CREATE INDEX IF NOT EXISTS idx_sync_log_tenant_id ON sync_log(tenant_id)")
+        self.fts_ready = True
+        logger.info(
+            f"✅ Message search index backfilled: {indexed} messages in {time.perf_counter() - started:.1f}s")
+        return indexed
 
-            conn.commit()
+    def _get_meta(self, key, default=None, cast=int):
+        """Read a value from db_meta"""
+        conn = self.get_read_connection()
+        try:
+            row = conn.execute(
+                "SELECT value FROM db_meta WHERE key = ?", (key,)).fetchone()
+            return cast(row[0]) if row else default
+        finally:
             conn.close()
 
-            logger.info(
-                "✅ Database initialized (analytics + saas + auth + sync compatible)")
+    def _set_meta(self, cursor, key, value):
+        """Write a db_meta value inside the caller's transaction"""
+        cursor.execute("""
+            INSERT INTO db_meta (key, value) VALUES (?, ?)
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value
+        """, (key, str(value)))
 
-        except Exception as e:
-            logger.error(f"❌ Database initialization error: {e}")
-            raise
+    def _bump_data_version(self, cursor):
+        """Bump data_version inside the caller's transaction (commits with the data)"""
+        cursor.execute("""
+            INSERT INTO db_meta (key, value) VALUES ('data_version', '1')
+            ON CONFLICT(key) DO UPDATE SET
+                value = CAST(CAST(db_meta.value AS INTEGER) + 1 AS TEXT)
+        """)
+
+    def get_data_version(self):
+        """Counter bumped by every write to conversations / rollups
+        (admin API result cache key: same version = same data)"""
+        return self._get_meta('data_version', 0)
+
+    def get_connection(self):
+        """Pooled read/write connection - conn.close() returns it to the pool
+        (sqlite3.Connection, or its PostgreSQL look-alike from db_backends)"""
+        return self.backend.connect()
+
+    def get_read_connection(self):
+        """Pooled query_only connection for analytics/admin reads"""
+        return self.backend.read_connect()
+
+    def close(self):
+        """Close all pooled connections (shutdown)"""
+        self.backend.close()
 
     # =========================
     # SYNC LOG METHODS
@@ -361,14 +1340,23 @@ class Database:
         cursor.execute("""
             INSERT INTO tenants (id, name, domain, api_key, plan)
             VALUES (?, ?, ?, ?, ?)
+            RETURNING *
         """, (tenant_id, name, domain, api_key, plan))
+        tenant = dict(cursor.fetchone())
         conn.commit()
         conn.close()
 
+        # Usable right away by /api/chat in this process
+        self.tenants.add(tenant)
         return {"tenant_id": tenant_id, "api_key": api_key}
 
     def get_tenant_by_api_key(self, api_key):
-        conn = self.get_connection()
+        """Resolve an api_key via the in-memory TenantRegistry (None if invalid)"""
+        return self.tenants.resolve(api_key)
+
+    def find_tenant_by_api_key(self, api_key):
+        """Tenant row straight from the database (registry fallback)"""
+        conn = self.get_read_connection()
         cursor = conn.cursor()
         cursor.execute("SELECT * FROM tenants WHERE api_key = ?", (api_key,))
         row = cursor.fetchone()
@@ -510,63 +1498,34 @@ class Database:
         user_name=None,
         user_email=None,
         is_on_topic=True,
-        tenant_id="default"
+        tenant_id="default",
+        response_time_ms=None,
+        timings=None,
+        response_template=None
     ):
         try:
             conn = self.get_connection()
             cursor = conn.cursor()
-
-            cursor.execute(
-                "SELECT id FROM conversations WHERE session_id = ?", (session_id,))
-            conversation = cursor.fetchone()
-
-            if not conversation:
-                cursor.execute("""
-                    INSERT INTO conversations
-                    (tenant_id, session_id, user_id, user_name, user_email, user_ip, user_agent, start_time)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                """, (tenant_id, session_id, user_id, user_name, user_email, user_ip, user_agent, datetime.now()))
-                conn.commit()
-                conversation_id = cursor.lastrowid
-            else:
-                conversation_id = conversation["id"]
-
-                # Update user info if provided (user might have logged in mid-conversation)
-                if user_id or user_name or user_email:
-                    cursor.execute("""
-                        UPDATE conversations SET
-                            user_id = COALESCE(?, user_id),
-                            user_name = COALESCE(?, user_name),
-                            user_email = COALESCE(?, user_email)
-                        WHERE id = ?
-                    """, (user_id, user_name, user_email, conversation_id))
-                    conn.commit()
-
-            cursor.execute("""
-                INSERT INTO conversation_messages (conversation_id, sender, message)
-                VALUES (?, 'user', ?)
-            """, (conversation_id, user_message))
-
-            cursor.execute("""
-                INSERT INTO conversation_messages (conversation_id, sender, message)
-                VALUES (?, 'bot', ?)
-            """, (conversation_id, bot_response))
-
-            cursor.execute("""
-                UPDATE conversations SET
-                    total_messages = total_messages + 2,
-                    message_count_user = message_count_user + 1,
-                    message_count_bot = message_count_bot + 1,
-                    on_topic_count = on_topic_count + ?,
-                    off_topic_count = off_topic_count + ?,
-                    end_time = ?
-                WHERE id = ?
-            """, (
-                1 if is_on_topic else 0,
-                0 if is_on_topic else 1,
-                datetime.now(),
-                conversation_id
-            ))
+            # Take the write lock up-front (busy_timeout applies, no upgrade deadlock)
+            cursor.execute("BEGIN IMMEDIATE")
+
+            conversation_id = self._save_turn(
+                cursor,
+                session_id=session_id,
+                user_message=user_message,
+                bot_response=bot_response,
+                user_ip=user_ip,
+                user_agent=user_agent,
+                user_id=user_id,
+                user_name=user_name,
+                user_email=user_email,
+                is_on_topic=is_on_topic,
+                tenant_id=tenant_id,
+                response_time_ms=response_time_ms,
+                timings=timings,
+                response_template=response_template
+            )
+            self._bump_data_version(cursor)
 
             conn.commit()
             conn.close()
@@ -576,79 +1535,436 @@ class Database:
             logger.error(f"❌ Error saving conversation: {e}")
             return None
 
-    # =========================
-    # ANALYTICS METHODS
-    # =========================
-    def get_conversations(self, limit=50, offset=0, filters=None, tenant_id=None):
-        """Get conversations with optional filters"""
+    def save_conversations_batch(self, turns):
+        """Save many chat turns in ONE transaction (group commit)
+
+        Args:
+            turns: List of dicts with save_conversation() keyword arguments
+
+        Returns:
+            int: Number of turns saved (a bad turn is skipped, not the batch)
+        """
+        if not turns:
+            return 0
+
+        conn = self.get_connection()
         try:
-            conn = self.get_connection()
             cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            saved = 0
 
-            query = "SELECT * FROM conversations WHERE 1=1"
-            params = []
-
-            if tenant_id:
-                query += " AND tenant_id = ?"
-                params.append(tenant_id)
+            for turn in turns:
+                cursor.execute("SAVEPOINT turn")
+                try:
+                    self._save_turn(cursor, **turn)
+                    cursor.execute("RELEASE SAVEPOINT turn")
+                    saved += 1
+                except Exception as e:
+                    cursor.execute("ROLLBACK TO SAVEPOINT turn")
+                    cursor.execute("RELEASE SAVEPOINT turn")
+                    logger.error(
+                        f"❌ Error saving turn for session {str(turn.get('session_id'))[:8]}: {e}")
 
-            if filters:
-                if filters.get('date_from'):
-                    query += " AND DATE(start_time) >= ?"
-                    params.append(filters['date_from'])
+            if saved:
+                self._bump_data_version(cursor)
+            conn.commit()
+            return saved
+        finally:
+            conn.close()
 
-                if filters.get('date_to'):
-                    query += " AND DATE(start_time) <= ?"
-                    params.append(filters['date_to'])
+    def _save_turn(
+        self,
+        cursor,
+        session_id,
+        user_message,
+        bot_response,
+        user_ip=None,
+        user_agent=None,
+        user_id=None,
+        user_name=None,
+        user_email=None,
+        is_on_topic=True,
+        tenant_id="default",
+        response_time_ms=None,
+        timings=None,
+        response_template=None
+    ):
+        """Write one turn (conversation row + 2 messages) - caller commits
+
+        Single UPSERT on conversations.session_id (no lookup-then-insert race),
+        the daily rollup upserts, then one multi-row message insert.
+        timings is Deadline.report() of the request: its stages (plus the
+        time spent writing this turn, as 'db') go to the bot message's
+        timing_json and, with response_time_ms as 'total', to latency_daily
+        (bucketed by the conversation's start day, like analytics_daily).
+        response_template (e.g. "faq:retur:complete") marks bot_response as
+        fixed text: it is stored once in response_templates and referenced
+        """
+        started = time.perf_counter()
+        now = datetime.now()
+        on_topic = 1 if is_on_topic else 0
 
-                if filters.get('status'):
-                    query += " AND status = ?"
-                    params.append(filters['status'])
+        cursor.execute("""
+            INSERT INTO conversations
+            (tenant_id, session_id, user_id, user_name, user_email, user_ip, user_agent,
+             start_time, start_day, end_time, total_messages, message_count_user,
+             message_count_bot, on_topic_count, off_topic_count)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 2, 1, 1, ?, ?)
+            ON CONFLICT(session_id) DO UPDATE SET
+                user_id = COALESCE(excluded.user_id, conversations.user_id),
+                user_name = COALESCE(excluded.user_name, conversations.user_name),
+                user_email = COALESCE(excluded.user_email, conversations.user_email),
+                total_messages = conversations.total_messages + 2,
+                message_count_user = conversations.message_count_user + 1,
+                message_count_bot = conversations.message_count_bot + 1,
+                on_topic_count = conversations.on_topic_count + excluded.on_topic_count,
+                off_topic_count = conversations.off_topic_count + excluded.off_topic_count,
+                end_time = excluded.end_time
+            RETURNING id, tenant_id, start_day, total_messages
+        """, (tenant_id, session_id, user_id, user_name, user_email, user_ip, user_agent,
+              now, now.strftime('%Y-%m-%d'), now, on_topic, 1 - on_topic))
+        conversation_id, conv_tenant, conv_day, total_messages = cursor.fetchone()
+
+        # Counters go to the conversation's start day (same bucket as the list filters)
+        is_new = 1 if total_messages == 2 else 0
+        cursor.execute("""
+            INSERT INTO analytics_daily
+            (day, tenant_id, conversations, messages, on_topic, off_topic,
+             unique_sessions, response_time_sum_ms, response_time_count, last_updated)
+            VALUES (?, ?, ?, 2, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(day, tenant_id) DO UPDATE SET
+                conversations = analytics_daily.conversations + excluded.conversations,
+                messages = analytics_daily.messages + 2,
+                on_topic = analytics_daily.on_topic + excluded.on_topic,
+                off_topic = analytics_daily.off_topic + excluded.off_topic,
+                unique_sessions = analytics_daily.unique_sessions + excluded.unique_sessions,
+                response_time_sum_ms = analytics_daily.response_time_sum_ms + excluded.response_time_sum_ms,
+                response_time_count = analytics_daily.response_time_count + excluded.response_time_count,
+                last_updated = excluded.last_updated
+        """, (conv_day or now.strftime('%Y-%m-%d'), conv_tenant or 'default',
+              is_new, on_topic, 1 - on_topic, is_new,
+              response_time_ms or 0, 1 if response_time_ms is not None else 0, now))
+
+        self._count_question(cursor, conv_tenant or 'default', user_message, now)
+
+        stages = {}
+        timing_json = None
+        if timings:
+            stages = {name: int(ms) for name, ms in (timings.get("stages") or {}).items()}
+            # The request only queued the turn; this is the actual write
+            stages["db"] = int((time.perf_counter() - started) * 1000)
+            breakdown = {"stages": stages}
+            if timings.get("skipped"):
+                breakdown["skipped"] = list(timings["skipped"])
+            timing_json = json.dumps(breakdown, separators=(",", ":"))
+
+        message, template_ref, body_zlib = self._encode_bot_message(
+            cursor, bot_response, response_template)
+        cursor.execute("""
+            INSERT INTO conversation_messages
+            (conversation_id, sender, message, response_time_ms, timing_json,
+             template_ref, body_zlib)
+            VALUES (?, 'user', ?, NULL, NULL, NULL, NULL), (?, 'bot', ?, ?, ?, ?, ?)
+        """, (conversation_id, user_message, conversation_id, message,
+              response_time_ms, timing_json, template_ref, body_zlib))
+        if message != bot_response and self.fts_enabled is None:
+            self._check_search_index()
+        if message != bot_response and self.fts_enabled:
+            # The trigger indexed '' - keep template/compressed replies searchable
+            cursor.execute(
+                "UPDATE conversation_messages_fts SET message = ? WHERE rowid = ?",
+                (bot_response, cursor.lastrowid))
+
+        # Same day bucket as analytics_daily: the conversation's start day
+        self._count_latency(cursor, conv_day or now.strftime('%Y-%m-%d'),
+                            conv_tenant or 'default', response_time_ms, stages)
+
+        return conversation_id
+
+    def _encode_bot_message(self, cursor, bot_response, response_template=None):
+        """Stored form of a bot reply: (message, template_ref, body_zlib)"""
+        if response_template and bot_response:
+            return "", self._template_ref(cursor, response_template, bot_response), None
+
+        if MESSAGE_COMPRESS_MIN_BYTES and self.backend.name == "sqlite" and bot_response:
+            raw = bot_response.encode('utf-8')
+            if len(raw) >= MESSAGE_COMPRESS_MIN_BYTES:
+                packed = zlib.compress(raw, MESSAGE_COMPRESS_LEVEL)
+                if len(packed) < len(raw) * 0.9:
+                    return "", None, packed
+
+        return bot_response, None, None
+
+    def _template_ref(self, cursor, template_id, body):
+        """response_templates id for (template_id, body); a changed text is a new version"""
+        version = hashlib.sha1(body.encode('utf-8')).hexdigest()[:16]
+        select = "SELECT id FROM response_templates WHERE template_id = ? AND version = ?"
+        cursor.execute(select, (template_id, version))
+        row = cursor.fetchone()
+        if row is None:
+            cursor.execute("""
+                INSERT INTO response_templates (template_id, version, body, created_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(template_id, version) DO NOTHING
+                RETURNING id
+            """, (template_id, version, body, datetime.now()))
+            row = cursor.fetchone()
+            if row is None:
+                # Inserted by another writer meanwhile (PostgreSQL)
+                cursor.execute(select, (template_id, version))
+                row = cursor.fetchone()
+        return row[0]
+
+    def _latency_samples(self, response_time_ms, stages):
+        """(stage, ms) pairs counted in latency_daily for one bot answer"""
+        samples = [(stage, ms) for stage, ms in stages.items() if ms is not None]
+        if response_time_ms is not None:
+            samples.append(("total", response_time_ms))
+        return samples
+
+    def _count_latency(self, cursor, day, tenant_id, response_time_ms, stages):
+        """Bump the latency_daily histogram buckets for one bot answer"""
+        samples = self._latency_samples(response_time_ms, stages)
+        if not samples:
+            return
+        cursor.executemany("""
+            INSERT INTO latency_daily (day, tenant_id, stage, bucket, count)
+            VALUES (?, ?, ?, ?, 1)
+            ON CONFLICT(day, tenant_id, stage, bucket) DO UPDATE SET
+                count = latency_daily.count + 1
+        """, [(day, tenant_id, stage, latency_bucket(ms)) for stage, ms in samples])
+
+    def _count_question(self, cursor, tenant_id, user_message, now):
+        """Bump the normalized-question counters (all-time for the tenant and
+        ALL_TENANTS + per day)"""
+        normalized = normalize_text(user_message)
+        if not normalized:
+            return
+        key = question_hash(normalized)
+
+        cursor.executemany("""
+            INSERT INTO question_stats (tenant_id, question_hash, message, count, last_seen)
+            VALUES (?, ?, ?, 1, ?)
+            ON CONFLICT(tenant_id, question_hash) DO UPDATE SET
+                count = question_stats.count + 1,
+                last_seen = excluded.last_seen
+        """, [(tenant_id, key, user_message, now), (ALL_TENANTS, key, user_message, now)])
+        cursor.execute("""
+            INSERT INTO question_stats_daily (day, tenant_id, question_hash, count)
+            VALUES (?, ?, ?, 1)
+            ON CONFLICT(day, tenant_id, question_hash) DO UPDATE SET
+                count = question_stats_daily.count + 1
+        """, (now.strftime('%Y-%m-%d'), tenant_id, key))
 
-                if filters.get('keyword'):
-                    keyword = filters['keyword']
-                    query += f" AND id IN (SELECT conversation_id FROM conversation_messages WHERE message LIKE ?)"
-                    params.append(f"%{keyword}%")
+    # =========================
+    # ANALYTICS METHODS
+    # =========================
+    def _build_conversation_filters(self, filters=None, tenant_id=None):
+        """WHERE clause shared by the list and count queries
+
+        Returns:
+            tuple: (where_sql, params, fts_match or None)
+        """
+        clauses = []
+        params = []
+        match = None
+        filters = filters or {}
+
+        if tenant_id:
+            clauses.append("tenant_id = ?")
+            params.append(tenant_id)
+
+        # Range predicates on the indexed day bucket (sargable)
+        if filters.get('date_from'):
+            clauses.append("start_day >= ?")
+            params.append(filters['date_from'])
+
+        if filters.get('date_to'):
+            clauses.append("start_day <= ?")
+            params.append(filters['date_to'])
+
+        if filters.get('status'):
+            clauses.append("status = ?")
+            params.append(filters['status'])
+
+        if filters.get('keyword'):
+            keyword = filters['keyword']
+            if not self.fts_ready and time.monotonic() >= self._fts_recheck_at:
+                self._check_search_index()
+            match = fts_match_query(keyword) if self.fts_ready else None
+            if match:
+                clauses.append("""id IN (
+                    SELECT conversation_id FROM conversation_messages_fts
+                    WHERE conversation_messages_fts MATCH ?)""")
+                params.append(match)
+            else:
+                # Template replies are stored once, in response_templates;
+                # long replies compressed (SQLite only, inflated by the pool's SQL function)
+                compressed = ("OR (body_zlib IS NOT NULL AND inflate(body_zlib) LIKE ?) "
+                              if self.backend.name == "sqlite" else "")
+                clause = (
+                    "id IN (SELECT conversation_id FROM conversation_messages "
+                    f"WHERE message {self.backend.ILIKE} ? {compressed}OR template_ref IN ("
+                    f"SELECT id FROM response_templates WHERE body {self.backend.ILIKE} ?))")
+                clauses.append(clause)
+                params.extend([f"%{keyword}%"] * clause.count("?"))
+
+        return " AND ".join(clauses) or "1=1", params, match
+
+    def _pruned_before(self, tenant_id):
+        """Retention watermark that applies to a list total (None = no pruning)
+
+        A tenant list honours its own and the all-tenant watermark; the
+        all-tenant list every watermark, as any tenant's pruning changes it
+        """
+        conn = self.get_read_connection()
+        try:
+            if tenant_id:
+                row = conn.execute(
+                    "SELECT MAX(value) FROM db_meta WHERE key IN (?, ?)",
+                    ("pruned_before:*", f"pruned_before:{tenant_id}")).fetchone()
+            else:
+                row = conn.execute(
+                    "SELECT MAX(value) FROM db_meta WHERE key LIKE 'pruned_before:%'").fetchone()
+            return row[0]
+        finally:
+            conn.close()
 
-            # Count total
-            count_query = f"SELECT COUNT(*) FROM conversations WHERE 1=1"
-            count_params = []
+    def _count_conversations(self, cursor, where, params, filters, tenant_id):
+        """Total for the list header: rollups when possible, else cached COUNT(*)
+
+        Returns:
+            tuple: (total, estimated)
+        """
+        filters = filters or {}
+
+        if not filters.get('status') and not filters.get('keyword'):
+            # Tenant/date filters only: answered by analytics_daily
+            query = "SELECT COALESCE(SUM(conversations), 0) FROM analytics_daily WHERE 1=1"
+            rollup_params = []
+            day_from = filters.get('date_from')
+            pruned_before = self._pruned_before(tenant_id)
+            older = 0
+            if pruned_before and (not day_from or day_from < pruned_before):
+                # Rollups still count the conversations deleted before the
+                # watermark: count the rows left there instead (few, indexed)
+                cursor.execute(
+                    f"SELECT COUNT(*) FROM conversations WHERE {where} AND start_day < ?",
+                    list(params) + [pruned_before])
+                older = cursor.fetchone()[0]
+                day_from = pruned_before
+            if day_from:
+                query += " AND day >= ?"
+                rollup_params.append(day_from)
+            if filters.get('date_to'):
+                query += " AND day <= ?"
+                rollup_params.append(filters['date_to'])
             if tenant_id:
-                count_query += " AND tenant_id = ?"
-                count_params.append(tenant_id)
-            if filters:
-                if filters.get('date_from'):
-                    count_query += " AND DATE(start_time) >= ?"
-                    count_params.append(filters['date_from'])
-                if filters.get('date_to'):
-                    count_query += " AND DATE(start_time) <= ?"
-                    count_params.append(filters['date_to'])
-                if filters.get('status'):
-                    count_query += " AND status = ?"
-                    count_params.append(filters['status'])
-
-            cursor.execute(count_query, count_params)
-            total = cursor.fetchone()[0]
-
-            # Get paginated results
-            query += " ORDER BY start_time DESC LIMIT ? OFFSET ?"
-            params.extend([limit, offset])
+                query += " AND tenant_id = ?"
+                rollup_params.append(tenant_id)
+            cursor.execute(query, rollup_params)
+            return older + cursor.fetchone()[0], True
+
+        key = (tenant_id, tuple(sorted((k, v) for k, v in filters.items() if v)))
+        now = time.monotonic()
+        with self._count_lock:
+            cached = self._count_cache.get(key)
+        if cached and cached[1] > now:
+            return cached[0], True
+
+        cursor.execute(f"SELECT COUNT(*) FROM conversations WHERE {where}", params)
+        total = cursor.fetchone()[0]
+
+        with self._count_lock:
+            if len(self._count_cache) >= CONVERSATION_COUNT_CACHE_SIZE:
+                self._count_cache = {
+                    k: v for k, v in self._count_cache.items() if v[1] > now}
+                if len(self._count_cache) >= CONVERSATION_COUNT_CACHE_SIZE:
+                    self._count_cache.clear()
+            self._count_cache[key] = (total, now + CONVERSATION_COUNT_TTL)
+        return total, False
+
+    def get_conversations(self, limit=50, cursor=None, filters=None, tenant_id=None, offset=0,
+                          raise_errors=False):
+        """Get one page of conversations (newest first) with optional filters
+
+        Keyset pagination on (start_time, id): pass the previous page's
+        next_cursor to continue (ValueError if the cursor is malformed).
+        offset is still honoured when no cursor is given (legacy clients)
+        but gets slower the deeper it goes.
+
+        With a keyword filter (and the FTS index ready) each conversation
+        carries a 'snippet' of its best matching message: HTML-escaped
+        text with the matches wrapped in <mark></mark>
+
+        raise_errors=True re-raises read errors instead of returning an
+        empty page (callers that cache the result must not cache that)
+
+        Returns:
+            dict: conversations, total, total_estimated, next_cursor
+        """
+        after = decode_cursor(cursor) if cursor else None
+        try:
+            where, params, match = self._build_conversation_filters(
+                filters, tenant_id)
+
+            conn = self.get_read_connection()
+            db_cursor = conn.cursor()
+
+            total, estimated = self._count_conversations(
+                db_cursor, where, params, filters, tenant_id)
+
+            query = f"SELECT * FROM conversations WHERE {where}"
+            page_params = list(params)
+            if after:
+                query += " AND (start_time, id) < (?, ?)"
+                page_params.extend(after)
+            # One extra row tells us whether there is a next page
+            query += " ORDER BY start_time DESC, id DESC LIMIT ?"
+            page_params.append(limit + 1)
+            if not after and offset:
+                query += " OFFSET ?"
+                page_params.append(offset)
+
+            db_cursor.execute(query, page_params)
+            conversations = [dict(row) for row in db_cursor.fetchall()]
+            has_more = len(conversations) > limit
+            conversations = conversations[:limit]
+
+            if match and conversations:
+                snippets = {}
+                placeholders = ",".join("?" * len(conversations))
+                db_cursor.execute(f"""
+                    SELECT conversation_id,
+                           snippet(conversation_messages_fts, 0, char(2), char(3), '…', 12)
+                    FROM conversation_messages_fts
+                    WHERE conversation_messages_fts MATCH ?
+                      AND conversation_id IN ({placeholders})
+                    ORDER BY rank
+                """, [match] + [conv['id'] for conv in conversations])
+                for conversation_id, snippet in db_cursor.fetchall():
+                    snippets.setdefault(conversation_id, mark_snippet(snippet))
+                for conv in conversations:
+                    conv['snippet'] = snippets.get(conv['id'])
 
-            cursor.execute(query, params)
-            rows = cursor.fetchall()
             conn.close()
-
-            conversations = [dict(row) for row in rows]
-            return conversations, total
+            return {
+                "conversations": conversations,
+                "total": total,
+                "total_estimated": estimated,
+                "next_cursor": encode_cursor(conversations[-1]) if has_more else None
+            }
 
         except Exception as e:
             logger.error(f"❌ Error get_conversations: {e}")
-            return [], 0
+            if raise_errors:
+                raise
+            return {"conversations": [], "total": 0, "total_estimated": False, "next_cursor": None}
 
     def get_conversation_messages(self, conversation_id):
         """Get all messages for a conversation"""
         try:
-            conn = self.get_connection()
+            conn = self.get_read_connection()
             cursor = conn.cursor()
 
             cursor.execute("""
@@ -660,29 +1976,85 @@ class Database:
             rows = cursor.fetchall()
             conn.close()
 
-            return [dict(row) for row in rows]
+            return self._expand_message_dicts([dict(row) for row in rows])
 
         except Exception as e:
             logger.error(f"❌ Error get_conversation_messages: {e}")
             return []
 
-    def get_analytics(self, days=30, tenant_id=None):
-        """Get overall analytics stats"""
+    def _template_bodies(self, refs):
+        """response_templates id -> body, fetching ids not cached yet
+        (a template version never changes, so the cache never goes stale)"""
+        missing = list({ref for ref in refs if ref is not None and ref not in self._templates})
+        if missing:
+            placeholders = ",".join("?" * len(missing))
+            conn = self.get_read_connection()
+            try:
+                rows = conn.execute(
+                    f"SELECT id, body FROM response_templates WHERE id IN ({placeholders})",
+                    missing).fetchall()
+            finally:
+                conn.close()
+            self._templates.update((row[0], row[1]) for row in rows)
+        return self._templates
+
+    def _message_text(self, message, template_ref, body_zlib, templates):
+        """Text of a stored message (see _encode_bot_message)"""
+        if template_ref is not None:
+            return templates.get(template_ref, message)
+        if body_zlib is not None:
+            return zlib.decompress(body_zlib).decode('utf-8')
+        return message
+
+    def _expand_message_dicts(self, messages):
+        """Message row dicts with 'message' expanded (storage columns dropped)"""
+        templates = self._template_bodies([m.get('template_ref') for m in messages])
+        for m in messages:
+            m['message'] = self._message_text(
+                m['message'], m.pop('template_ref', None), m.pop('body_zlib', None), templates)
+        return messages
+
+    def _expand_message_batches(self, batches):
+        """(columns, rows) batches with 'message' expanded; the template_ref /
+        body_zlib columns the query selected for it are dropped"""
+        for columns, rows in batches:
+            if "template_ref" not in columns:
+                yield columns, rows
+                continue
+            m = columns.index("message")
+            t = columns.index("template_ref")
+            z = columns.index("body_zlib")
+            keep = [i for i in range(len(columns)) if i not in (t, z)]
+            templates = self._template_bodies([row[t] for row in rows])
+            expanded = []
+            for row in rows:
+                values = list(row)
+                values[m] = self._message_text(row[m], row[t], row[z], templates)
+                expanded.append(tuple(values[i] for i in keep))
+            yield [columns[i] for i in keep], expanded
+
+    def get_analytics(self, days=30, tenant_id=None, raise_errors=False):
+        """Get overall analytics stats (from the daily rollups)"""
         try:
-            conn = self.get_connection()
+            conn = self.get_read_connection()
             cursor = conn.cursor()
 
+            first_day = (datetime.now() - timedelta(days=days)
+                         ).strftime('%Y-%m-%d')
+
             query = """
                 SELECT
-                    COUNT(DISTINCT id) as total_conversations,
-                    SUM(total_messages) as total_messages,
-                    SUM(on_topic_count) as on_topic_count,
-                    SUM(off_topic_count) as off_topic_count,
-                    COUNT(DISTINCT session_id) as unique_sessions
-                FROM conversations
-                WHERE start_time >= datetime('now', '-' || ? || ' days')
+                    SUM(conversations) as total_conversations,
+                    SUM(messages) as total_messages,
+                    SUM(on_topic) as on_topic_count,
+                    SUM(off_topic) as off_topic_count,
+                    SUM(unique_sessions) as unique_sessions,
+                    SUM(response_time_sum_ms) as response_time_sum_ms,
+                    SUM(response_time_count) as response_time_count
+                FROM analytics_daily
+                WHERE day >= ?
             """
-            params = [days]
+            params = [first_day]
 
             if tenant_id:
                 query += " AND tenant_id = ?"
@@ -698,6 +2070,7 @@ class Database:
                 on_topic = row[2] or 0
                 off_topic = row[3] or 0
                 unique = row[4] or 0
+                rt_count = row[6] or 0
 
                 on_topic_pct = (on_topic / (on_topic + off_topic) * 100) if (
                     on_topic + off_topic) > 0 else 0
@@ -707,7 +2080,8 @@ class Database:
                     "total_messages": total_msgs,
                     "on_topic_percentage": round(on_topic_pct, 2),
                     "off_topic_percentage": round(100 - on_topic_pct, 2),
-                    "unique_sessions": unique
+                    "unique_sessions": unique,
+                    "avg_response_time_ms": int((row[5] or 0) / rt_count) if rt_count else 0
                 }
 
             return {
@@ -715,35 +2089,42 @@ class Database:
                 "total_messages": 0,
                 "on_topic_percentage": 0,
                 "off_topic_percentage": 0,
-                "unique_sessions": 0
+                "unique_sessions": 0,
+                "avg_response_time_ms": 0
             }
 
         except Exception as e:
             logger.error(f"❌ Error get_analytics: {e}")
+            if raise_errors:
+                raise
             return {}
 
-    def get_daily_stats(self, days=30, tenant_id=None):
-        """Get daily statistics"""
+    def get_daily_stats(self, days=30, tenant_id=None, raise_errors=False):
+        """Get daily statistics (one rollup row per day and tenant)"""
         try:
-            conn = self.get_connection()
+            conn = self.get_read_connection()
             cursor = conn.cursor()
 
+            # Day buckets are local dates (same clock as start_time)
+            first_day = (datetime.now() - timedelta(days=days)
+                         ).strftime('%Y-%m-%d')
+
             query = """
                 SELECT
-                    DATE(start_time) as date,
-                    COUNT(id) as conversations,
-                    SUM(total_messages) as messages,
-                    SUM(on_topic_count) as on_topic
-                FROM conversations
-                WHERE start_time >= datetime('now', '-' || ? || ' days')
+                    day as date,
+                    SUM(conversations) as conversations,
+                    SUM(messages) as messages,
+                    SUM(on_topic) as on_topic
+                FROM analytics_daily
+                WHERE day >= ?
             """
-            params = [days]
+            params = [first_day]
 
             if tenant_id:
                 query += " AND tenant_id = ?"
                 params.append(tenant_id)
 
-            query += " GROUP BY DATE(start_time) ORDER BY date DESC"
+            query += " GROUP BY day ORDER BY day DESC"
 
             cursor.execute(query, params)
             rows = cursor.fetchall()
@@ -753,50 +2134,202 @@ class Database:
 
         except Exception as e:
             logger.error(f"❌ Error get_daily_stats: {e}")
+            if raise_errors:
+                raise
             return []
 
-    def get_top_questions(self, limit=10, tenant_id=None):
-        """Get most asked questions"""
+    def get_top_questions(self, limit=10, tenant_id=None, days=None, raise_errors=False):
+        """Get most asked questions (normalized counters)
+
+        Args:
+            limit: Number of questions
+            tenant_id: Restrict to one tenant
+            days: Only count the last N days (per-day buckets, by the day the
+                question was asked, not the conversation's start day);
+                None = all time
+            raise_errors: Re-raise read errors instead of returning []
+        """
         try:
-            conn = self.get_connection()
+            conn = self.get_read_connection()
+            cursor = conn.cursor()
+            params = []
+
+            if days:
+                first_day = (datetime.now() - timedelta(days=days)
+                             ).strftime('%Y-%m-%d')
+                query = """
+                    SELECT MIN(q.message) as message, SUM(d.count) as count
+                    FROM question_stats_daily d
+                    JOIN question_stats q
+                        ON q.tenant_id = d.tenant_id AND q.question_hash = d.question_hash
+                    WHERE d.day >= ?
+                """
+                params.append(first_day)
+                if tenant_id:
+                    query += " AND d.tenant_id = ?"
+                    params.append(tenant_id)
+                query += " GROUP BY d.question_hash ORDER BY count DESC LIMIT ?"
+
+            else:
+                # Served straight from idx_question_stats_count (all tenants
+                # = the ALL_TENANTS counters)
+                query = """
+                    SELECT message, count
+                    FROM question_stats
+                    WHERE tenant_id = ?
+                    ORDER BY count DESC
+                    LIMIT ?
+                """
+                params.append(tenant_id or ALL_TENANTS)
+
+            params.append(limit)
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+            conn.close()
+
+            return [dict(row) for row in rows]
+
+        except Exception as e:
+            logger.error(f"❌ Error get_top_questions: {e}")
+            if raise_errors:
+                raise
+            return []
+
+    def get_latency_stats(self, days=30, tenant_id=None, raise_errors=False):
+        """p50/p95 response time per stage (from the latency histograms)
+
+        Days are conversation start days, as in get_daily_stats: a late
+        answer in a conversation started yesterday counts for yesterday.
+
+        Returns:
+            dict: {"stages": {stage: {count, p50_ms, p95_ms}} for the whole
+            window, "daily": [{"date", "stages": {...}}] newest first}
+        """
+        try:
+            conn = self.get_read_connection()
             cursor = conn.cursor()
 
+            first_day = (datetime.now() - timedelta(days=days)
+                         ).strftime('%Y-%m-%d')
+
             query = """
-                SELECT message, COUNT(*) as count
-                FROM conversation_messages
-                WHERE sender = 'user'
-                  AND conversation_id IN (
-                    SELECT id FROM conversations
+                SELECT day, stage, bucket, SUM(count) as count
+                FROM latency_daily
+                WHERE day >= ?
             """
-            params = []
+            params = [first_day]
 
             if tenant_id:
-                query += " WHERE tenant_id = ?"
+                query += " AND tenant_id = ?"
                 params.append(tenant_id)
 
-            query += """
-                  )
-                GROUP BY message
-                ORDER BY count DESC
-                LIMIT ?
-            """
-            params.append(limit)
+            query += " GROUP BY day, stage, bucket"
 
             cursor.execute(query, params)
             rows = cursor.fetchall()
             conn.close()
 
-            return [dict(row) for row in rows]
+            window = {}
+            daily = {}
+            for day, stage, bucket, count in rows:
+                window.setdefault(stage, {})
+                window[stage][bucket] = window[stage].get(bucket, 0) + count
+                daily.setdefault(day, {}).setdefault(stage, {})[bucket] = count
+
+            def summary(histograms):
+                return {
+                    stage: {
+                        "count": sum(counts.values()),
+                        "p50_ms": histogram_percentile(counts, 0.50),
+                        "p95_ms": histogram_percentile(counts, 0.95)
+                    }
+                    for stage, counts in sorted(histograms.items())
+                }
+
+            return {
+                "stages": summary(window),
+                "daily": [{"date": day, "stages": summary(daily[day])}
+                          for day in sorted(daily, reverse=True)]
+            }
 
         except Exception as e:
-            logger.error(f"❌ Error get_top_questions: {e}")
-            return []
+            logger.error(f"❌ Error get_latency_stats: {e}")
+            if raise_errors:
+                raise
+            return {"stages": {}, "daily": []}
 
     def delete_conversation(self, conversation_id):
         """Delete conversation and all its messages"""
         try:
             conn = self.get_connection()
             cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            greatest = self.backend.GREATEST
+
+            # Take the conversation back out of its daily rollup
+            cursor.execute("""
+                SELECT c.start_day, COALESCE(c.tenant_id, 'default'), c.total_messages,
+                       c.on_topic_count, c.off_topic_count,
+                       COALESCE(SUM(m.response_time_ms), 0), COUNT(m.response_time_ms)
+                FROM conversations c
+                LEFT JOIN conversation_messages m
+                    ON m.conversation_id = c.id AND m.sender = 'bot'
+                WHERE c.id = ?
+                GROUP BY c.id
+            """, (conversation_id,))
+            row = cursor.fetchone()
+            if row and row[0]:
+                cursor.execute(f"""
+                    UPDATE analytics_daily SET
+                        conversations = {greatest}(conversations - 1, 0),
+                        unique_sessions = {greatest}(unique_sessions - 1, 0),
+                        messages = {greatest}(messages - ?, 0),
+                        on_topic = {greatest}(on_topic - ?, 0),
+                        off_topic = {greatest}(off_topic - ?, 0),
+                        response_time_sum_ms = {greatest}(response_time_sum_ms - ?, 0),
+                        response_time_count = {greatest}(response_time_count - ?, 0),
+                        last_updated = ?
+                    WHERE day = ? AND tenant_id = ?
+                """, (row[2] or 0, row[3] or 0, row[4] or 0, row[5], row[6],
+                      datetime.now(), row[0], row[1]))
+
+            if row:
+                cursor.execute(f"""
+                    SELECT message, {self.backend.local_day('timestamp')}
+                    FROM conversation_messages
+                    WHERE conversation_id = ? AND sender = 'user'
+                """, (conversation_id,))
+                for message, day in cursor.fetchall():
+                    normalized = normalize_text(message)
+                    if not normalized:
+                        continue
+                    key = question_hash(normalized)
+                    cursor.execute(f"""
+                        UPDATE question_stats SET count = {greatest}(count - 1, 0)
+                        WHERE tenant_id IN (?, ?) AND question_hash = ?
+                    """, (row[1], ALL_TENANTS, key))
+                    cursor.execute(f"""
+                        UPDATE question_stats_daily SET count = {greatest}(count - 1, 0)
+                        WHERE day = ? AND tenant_id = ? AND question_hash = ?
+                    """, (day, row[1], key))
+
+                cursor.execute(f"""
+                    SELECT response_time_ms, timing_json, {self.backend.local_day('timestamp')}
+                    FROM conversation_messages
+                    WHERE conversation_id = ? AND sender = 'bot'
+                      AND (response_time_ms IS NOT NULL OR timing_json IS NOT NULL)
+                """, (conversation_id,))
+                buckets = []
+                for response_time_ms, timing_json, day in cursor.fetchall():
+                    buckets.extend(
+                        (row[0] or day, row[1], stage, latency_bucket(ms))
+                        for stage, ms in self._latency_samples(
+                            response_time_ms, timing_stages(timing_json)))
+                if buckets:
+                    cursor.executemany(f"""
+                        UPDATE latency_daily SET count = {greatest}(count - 1, 0)
+                        WHERE day = ? AND tenant_id = ? AND stage = ? AND bucket = ?
+                    """, buckets)
 
             cursor.execute("""
                 DELETE FROM conversation_messages
@@ -807,6 +2340,7 @@ class Database:
                 DELETE FROM conversations
                 WHERE id = ?
             """, (conversation_id,))
+            self._bump_data_version(cursor)
 
             conn.commit()
             conn.close()
@@ -816,76 +2350,514 @@ class Database:
             logger.error(f"❌ Error delete_conversation: {e}")
             return False
 
+    def _export_query(self, filters=None, tenant_id=None, include_messages=False):
+        """SELECT for exports (same filters as the conversations list)"""
+        where, params, _ = self._build_conversation_filters(filters, tenant_id)
+
+        if not include_messages:
+            query = f"""
+                SELECT * FROM conversations
+                WHERE {where}
+                ORDER BY start_time DESC, id DESC
+            """
+            return query, params
+
+        # One row per message, conversation columns repeated
+        query = f"""
+            SELECT c.*,
+                   m.id as message_id,
+                   m.sender as sender,
+                   m.message as message,
+                   m.message_type as message_type,
+                   m.timestamp as message_timestamp,
+                   m.response_time_ms as response_time_ms,
+                   m.template_ref as template_ref,
+                   m.body_zlib as body_zlib
+            FROM (SELECT * FROM conversations WHERE {where}) c
+            LEFT JOIN conversation_messages m ON m.conversation_id = c.id
+            ORDER BY c.start_time DESC, c.id DESC, m.id ASC
+        """
+        return query, params
+
+    def iter_export_rows(self, filters=None, tenant_id=None, include_messages=False,
+                         batch_size=EXPORT_BATCH_SIZE):
+        """Yield (columns, rows) batches for an export, fetchmany() at a time
+
+        The read connection stays checked out until the generator finishes
+        or is closed (client disconnect closes it via GeneratorExit)
+        """
+        query, params = self._export_query(filters, tenant_id, include_messages)
+        return self._expand_message_batches(self._iter_batches(query, params, batch_size))
+
+    def _iter_batches(self, query, params, batch_size):
+        conn = self.get_read_connection()
+        try:
+            # Server-side cursor on PostgreSQL (rows arrive batch by batch)
+            cursor = self.backend.stream_cursor(conn)
+            cursor.execute(query, params)
+            columns = [description[0] for description in cursor.description]
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield columns, rows
+        finally:
+            conn.close()
+
+    def iter_conversations_csv(self, filters=None, tenant_id=None, include_messages=False,
+                               batch_size=EXPORT_BATCH_SIZE):
+        """Stream a CSV export as UTF-8 byte chunks (one chunk per batch)
+
+        Args:
+            filters: date_from / date_to / status / keyword (as get_conversations)
+            tenant_id: Restrict to one tenant
+            include_messages: One row per message with the message text
+        """
+        output = io.StringIO()
+        writer = csv.writer(output)
+        header_written = False
+
+        for columns, rows in self.iter_export_rows(
+                filters, tenant_id, include_messages, batch_size):
+            if not header_written:
+                writer.writerow(columns)
+                header_written = True
+            writer.writerows(tuple(row) for row in rows)
+            yield output.getvalue().encode('utf-8')
+            output.seek(0)
+            output.truncate()
+
+        if not header_written:
+            query, params = self._export_query(filters, tenant_id, include_messages)
+            conn = self.get_read_connection()
+            try:
+                cursor = conn.execute(query + " LIMIT 0", params)
+                writer.writerow([description[0] for description in cursor.description])
+            finally:
+                conn.close()
+            yield output.getvalue().encode('utf-8')
+
+    def _parquet_schema(self, pa, table):
+        """Arrow schema for PARQUET_COLUMNS[table] (category = dictionary-encoded)"""
+        types = {
+            "int64": pa.int64(),
+            "string": pa.string(),
+            "category": pa.dictionary(pa.int32(), pa.string()),
+            "timestamp": pa.timestamp('us'),
+            "date": pa.date32(),
+        }
+        return pa.schema([(name, types[kind]) for name, kind in PARQUET_COLUMNS[table]])
+
+    def _arrow_column(self, pa, values, kind):
+        """SQLite values -> typed Arrow array"""
+        if kind == "category":
+            return pa.array(values, pa.string()).dictionary_encode()
+        if kind in ("timestamp", "date"):
+            target = pa.timestamp('us') if kind == "timestamp" else pa.date32()
+            try:
+                return pa.array(values, pa.string()).cast(target)
+            except pa.ArrowInvalid:
+                # Odd legacy values (e.g. ISO 'T' separator) parsed one by one
+                parsed = []
+                for value in values:
+                    try:
+                        parsed.append(datetime.fromisoformat(value) if value else None)
+                    except (TypeError, ValueError):
+                        parsed.append(None)
+                if kind == "date":
+                    parsed = [value.date() if value else None for value in parsed]
+                return pa.array(parsed, target)
+        return pa.array(values, pa.int64() if kind == "int64" else pa.string())
+
+    def export_parquet(self, destination, table="conversations", filters=None,
+                       tenant_id=None, batch_size=PARQUET_BATCH_SIZE):
+        """Write conversations (or their messages) to a Parquet file in batches
+
+        Needs the optional pyarrow dependency (ImportError otherwise).
+        tenant_id / status / sender / message_type are dictionary-encoded,
+        timestamps typed; one row group per fetch batch keeps memory bounded.
+
+        Args:
+            destination: File path or writable binary file object
+            table: 'conversations' or 'messages'
+            filters: date_from / date_to / status / keyword (as get_conversations)
+            tenant_id: Restrict to one tenant
+
+        Returns:
+            int: Number of rows written
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if table not in PARQUET_COLUMNS:
+            raise ValueError(f"Unknown export table: {table}")
+
+        where, params, _ = self._build_conversation_filters(filters, tenant_id)
+        if table == "conversations":
+            columns = ", ".join(name for name, _ in PARQUET_COLUMNS[table])
+            query = f"""
+                SELECT {columns} FROM conversations
+                WHERE {where}
+                ORDER BY start_time DESC, id DESC
+            """
+        else:
+            query = f"""
+                SELECT m.id, m.conversation_id, c.tenant_id, m.sender, m.message,
+                       m.message_type, m.timestamp, m.response_time_ms, m.status,
+                       m.template_ref, m.body_zlib
+                FROM (SELECT id, tenant_id, start_time FROM conversations WHERE {where}) c
+                JOIN conversation_messages m ON m.conversation_id = c.id
+                ORDER BY c.start_time DESC, c.id DESC, m.id ASC
+            """
+
+        schema = self._parquet_schema(pa, table)
+        kinds = [kind for _, kind in PARQUET_COLUMNS[table]]
+        written = 0
+
+        with pq.ParquetWriter(destination, schema, compression='zstd') as writer:
+            for _, rows in self._expand_message_batches(
+                    self._iter_batches(query, params, batch_size)):
+                values = list(zip(*rows))
+                arrays = [self._arrow_column(pa, list(column), kind)
+                          for column, kind in zip(values, kinds)]
+                writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+                written += len(rows)
+
+        return written
+
     def export_conversations_csv(self, tenant_id=None):
-        """Export conversations to CSV"""
+        """Export conversations to CSV (whole file in memory - prefer iter_conversations_csv)"""
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
+            data = b"".join(self.iter_conversations_csv(tenant_id=tenant_id))
+            # Header only = nothing to export
+            return data if data.count(b"\n") > 1 else None
 
-            query = "SELECT * FROM conversations WHERE 1=1"
-            params = []
+        except Exception as e:
+            logger.error(f"❌ Error export_conversations_csv: {e}")
+            return None
 
-            if tenant_id:
-                query += " AND tenant_id = ?"
-                params.append(tenant_id)
+    def cleanup_old_conversations(self, days=90, tenant_id=None,
+                                  batch_size=RETENTION_BATCH_SIZE, pause_ms=RETENTION_PAUSE_MS):
+        """Delete conversations (and their messages) older than N days
 
-            query += " ORDER BY start_time DESC"
+        Works in batches of batch_size conversations, one short write
+        transaction each, sleeping pause_ms between them. Daily rollups and
+        question counters are kept.
 
-            cursor.execute(query, params)
-            rows = cursor.fetchall()
+        Returns:
+            int: Number of conversations deleted
+        """
+        cutoff_day = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
+        deleted = 0
 
-            if not rows:
-                return None
+        try:
+            conn = self.get_connection()
+            try:
+                cursor = conn.cursor()
+                while True:
+                    cursor.execute("BEGIN IMMEDIATE")
+                    query = "SELECT id FROM conversations WHERE start_day < ?"
+                    params = [cutoff_day]
+                    if tenant_id:
+                        query += " AND tenant_id = ?"
+                        params.append(tenant_id)
+                    query += " LIMIT ?"
+                    params.append(batch_size)
+
+                    cursor.execute(query, params)
+                    ids = [row[0] for row in cursor.fetchall()]
+                    if ids:
+                        placeholders = ",".join("?" * len(ids))
+                        # Explicit, so it does not depend on foreign_keys/cascade
+                        cursor.execute(
+                            f"DELETE FROM conversation_messages WHERE conversation_id IN ({placeholders})", ids)
+                        cursor.execute(
+                            f"DELETE FROM conversations WHERE id IN ({placeholders})", ids)
+                        deleted += len(ids)
+                        # With the delete: list totals stop trusting the rollups there
+                        self._advance_pruned_before(cursor, tenant_id, cutoff_day)
+                    last_batch = len(ids) < batch_size
+                    self._bump_data_version(cursor)
+                    conn.commit()
 
-            # Create CSV
-            output = io.StringIO()
-            writer = csv.writer(output)
+                    if last_batch:
+                        break
+                    if pause_ms:
+                        time.sleep(pause_ms / 1000)
+            finally:
+                conn.close()
 
-            # Headers
-            headers = [description[0]
-                       for description in cursor.description]
-            writer.writerow(headers)
+            return deleted
 
-            # Data
-            for row in rows:
-                writer.writerow(row)
+        except Exception as e:
+            logger.error(f"❌ Error cleanup_old_conversations: {e}")
+            return deleted
+
+    def _advance_pruned_before(self, cursor, tenant_id, cutoff_day):
+        """Set pruned_before:<tenant|*> inside the caller's transaction
+
+        = first day with no deleted conversations (the run only deleted
+        conversations started before cutoff_day). List totals count the
+        rows left before it instead of trusting the rollups. Never moves
+        back: an earlier run may have deleted up to a later day
+        """
+        key = f"pruned_before:{tenant_id or '*'}"
+        cursor.execute("SELECT value FROM db_meta WHERE key = ?", (key,))
+        row = cursor.fetchone()
+        if not row or row[0] < cutoff_day:
+            self._set_meta(cursor, key, cutoff_day)
+
+    def archive_old_conversations(self, days, batch_size=RETENTION_BATCH_SIZE,
+                                  pause_ms=RETENTION_PAUSE_MS):
+        """Move conversations idle for more than N days to the monthly archive
+
+        Per batch: read conversations + messages, then in one short write
+        transaction append the ones still idle to the archive (fsync'd) and
+        delete exactly those.
+        Rollups and question counters keep their history.
+
+        Returns:
+            dict: archived conversations / messages and months touched
+        """
+        cutoff = datetime.now() - timedelta(days=days)
+        cutoff_day = cutoff.strftime('%Y-%m-%d')
+        cutoff_time = str(cutoff)
+        archived = 0
+        archived_messages = 0
+        months = set()
+        last_id = 0
+
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            while True:
+                # Idle = started AND last active before the cutoff
+                cursor.execute("""
+                    SELECT * FROM conversations
+                    WHERE start_day < ? AND (end_time IS NULL OR end_time < ?)
+                      AND id > ?
+                    ORDER BY id
+                    LIMIT ?
+                """, (cutoff_day, cutoff_time, last_id, batch_size))
+                conversations = [dict(row) for row in cursor.fetchall()]
+                if not conversations:
+                    break
+                last_id = conversations[-1]['id']
+                ids = [conv['id'] for conv in conversations]
+                placeholders = ",".join("?" * len(ids))
+
+                cursor.execute(f"""
+                    SELECT * FROM conversation_messages
+                    WHERE conversation_id IN ({placeholders})
+                    ORDER BY id
+                """, ids)
+                messages = {}
+                for row in self._expand_message_dicts([dict(row) for row in cursor.fetchall()]):
+                    messages.setdefault(row['conversation_id'], []).append(row)
+
+                # Re-check idleness under the write lock: a conversation that
+                # got a new turn meanwhile stays and is not archived. One that
+                # is still idle had no write since it was read above, so the
+                # copy appended is exactly what gets deleted
+                cursor.execute("BEGIN IMMEDIATE")
+                # (SQLite: BEGIN IMMEDIATE already holds the write lock)
+                lock_rows = "" if self.backend.name == "sqlite" else " FOR UPDATE"
+                cursor.execute(f"""
+                    SELECT id FROM conversations
+                    WHERE id IN ({placeholders}) AND (end_time IS NULL OR end_time < ?)
+                """ + lock_rows, ids + [cutoff_time])
+                idle_ids = {row[0] for row in cursor.fetchall()}
+                if idle_ids:
+                    months.update(self.archive.append([
+                        {"conversation": conv, "messages": messages.get(conv['id'], [])}
+                        for conv in conversations if conv['id'] in idle_ids
+                    ]))
+
+                    idle = sorted(idle_ids)
+                    idle_placeholders = ",".join("?" * len(idle))
+                    cursor.execute(f"""
+                        DELETE FROM conversation_messages
+                        WHERE conversation_id IN ({idle_placeholders})
+                    """, idle)
+                    archived_messages += cursor.rowcount
+                    cursor.execute(
+                        f"DELETE FROM conversations WHERE id IN ({idle_placeholders})", idle)
+                    archived += cursor.rowcount
+                    # With the delete: list totals stop trusting the rollups there
+                    self._advance_pruned_before(cursor, None, cutoff_day)
+                    self._bump_data_version(cursor)
+                conn.commit()
 
+                if len(conversations) < batch_size:
+                    break
+                if pause_ms:
+                    time.sleep(pause_ms / 1000)
+        finally:
             conn.close()
 
-            csv_str = output.getvalue()
-            return csv_str.encode('utf-8')
+        logger.info(
+            f"🗄️ Archived {archived} conversations ({archived_messages} messages) to {sorted(months)}")
+        return {
+            "archived_conversations": archived,
+            "archived_messages": archived_messages,
+            "months": sorted(months)
+        }
 
+    def get_archived_conversation(self, conversation_id):
+        """Conversation + messages from cold storage (None if not archived)"""
+        try:
+            return self.archive.find_conversation(conversation_id)
         except Exception as e:
-            logger.error(f"❌ Error export_conversations_csv: {e}")
+            logger.error(f"❌ Error get_archived_conversation: {e}")
             return None
 
-    def cleanup_old_conversations(self, days=90, tenant_id=None):
-        """Delete conversations older than N days"""
+    def purge_orphan_messages(self, batch_size=RETENTION_BATCH_SIZE,
+                              scan_size=RETENTION_BATCH_SIZE * 100, pause_ms=RETENTION_PAUSE_MS):
+        """Delete messages whose conversation no longer exists
+
+        (left behind by cleanups that ran without foreign_keys=ON)
+        Orphans are looked up on a read connection, scan_size message ids at
+        a time, so the scan never holds the write lock; only the ids found
+        are deleted, batch_size per short write transaction. No orphans =
+        no write transaction at all
+        """
+        deleted = 0
+        read_conn = self.get_read_connection()
+        conn = self.get_connection()
         try:
-            conn = self.get_connection()
             cursor = conn.cursor()
+            max_id = read_conn.execute(
+                "SELECT COALESCE(MAX(id), 0) FROM conversation_messages").fetchone()[0]
+            last_id = 0
+            while last_id < max_id:
+                orphans = [row[0] for row in read_conn.execute("""
+                    SELECT m.id FROM conversation_messages m
+                    WHERE m.id > ? AND m.id <= ?
+                      AND NOT EXISTS (
+                          SELECT 1 FROM conversations c WHERE c.id = m.conversation_id
+                      )
+                """, (last_id, last_id + scan_size)).fetchall()]
+                last_id += scan_size
+
+                for start in range(0, len(orphans), batch_size):
+                    ids = orphans[start:start + batch_size]
+                    placeholders = ",".join("?" * len(ids))
+                    cursor.execute("BEGIN IMMEDIATE")
+                    # Re-checked, in case the conversation id was reused meanwhile
+                    cursor.execute(f"""
+                        DELETE FROM conversation_messages
+                        WHERE id IN ({placeholders})
+                          AND NOT EXISTS (
+                              SELECT 1 FROM conversations c
+                              WHERE c.id = conversation_messages.conversation_id
+                          )
+                    """, ids)
+                    deleted += cursor.rowcount
+                    conn.commit()
+                    if pause_ms:
+                        time.sleep(pause_ms / 1000)
+        finally:
+            read_conn.close()
+            conn.close()
 
-            query = """
-                DELETE FROM conversations
-                WHERE start_time < datetime('now', '-' || ? || ' days')
-            """
-            params = [days]
+        return deleted
 
-            if tenant_id:
-                query += " AND tenant_id = ?"
-                params.append(tenant_id)
+    def _file_bytes(self):
+        """Database file + WAL size on disk"""
+        return sum(os.path.getsize(path) for path in (self.db_path, self.db_path + "-wal")
+                   if os.path.exists(path))
 
-            cursor.execute(query, params)
-            deleted = cursor.rowcount
+    def incremental_vacuum(self, pages_per_step=VACUUM_PAGES_PER_STEP, pause_ms=RETENTION_PAUSE_MS):
+        """Return free pages to the OS a few thousand pages at a time
 
-            conn.commit()
+        Needs auto_vacuum=INCREMENTAL (new databases get it; older files are
+        converted once with enable_incremental_vacuum / db_tools.py).
+
+        Returns:
+            dict: auto_vacuum mode, pages freed, bytes reclaimed on disk
+        """
+        if self.backend.name != "sqlite":
+            # PostgreSQL reclaims dead rows with its own autovacuum
+            return {"auto_vacuum": self.backend.name, "pages_freed": 0,
+                    "free_bytes_released": 0, "file_bytes_before": 0,
+                    "file_bytes_after": 0, "bytes_reclaimed": 0}
+
+        conn = self.get_connection()
+        try:
+            mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+            page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+            free_before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            bytes_before = self._file_bytes()
+
+            if mode == 2:  # INCREMENTAL
+                while conn.execute("PRAGMA freelist_count").fetchone()[0] > 0:
+                    # executescript steps the pragma to completion (execute() frees one page)
+                    conn.executescript(f"PRAGMA incremental_vacuum({int(pages_per_step)});")
+                    if pause_ms:
+                        time.sleep(pause_ms / 1000)
+                # The main file only shrinks once the WAL is checkpointed
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+            elif free_before:
+                logger.warning(
+                    f"⚠️ {free_before} free pages but auto_vacuum is not INCREMENTAL - "
+                    "run `python db_tools.py enable-incremental-vacuum` once")
+
+            free_after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        finally:
             conn.close()
 
-            return deleted
+        return {
+            "auto_vacuum": {0: "none", 1: "full", 2: "incremental"}.get(mode, mode),
+            "pages_freed": free_before - free_after,
+            "free_bytes_released": (free_before - free_after) * page_size,
+            "file_bytes_before": bytes_before,
+            "file_bytes_after": self._file_bytes(),
+            "bytes_reclaimed": max(0, bytes_before - self._file_bytes())
+        }
+
+    def enable_incremental_vacuum(self):
+        """Switch an existing file to auto_vacuum=INCREMENTAL (one full VACUUM)
+
+        Rewrites the whole database and blocks writers while it runs -
+        maintenance window only
+        """
+        if self.backend.name != "sqlite":
+            return False
 
-        except Exception as e:
-            logger.error(f"❌ Error cleanup_old_conversations: {e}")
-            return 0
+        conn = self.get_connection()
+        try:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                return False
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("VACUUM")
+            return True
+        finally:
+            conn.close()
+
+    def run_retention(self, days=None, tenant_id=None):
+        """Retention job: old conversations, orphan messages, incremental vacuum
+
+        Args:
+            days: Delete conversations older than this (None/0 = keep all)
+
+        Returns:
+            dict: Counts + vacuum report
+        """
+        started = time.perf_counter()
+        deleted = self.cleanup_old_conversations(days=days, tenant_id=tenant_id) if days else 0
+        orphans = self.purge_orphan_messages()
+        vacuum = self.incremental_vacuum()
+
+        report = {
+            "deleted_conversations": deleted,
+            "deleted_orphan_messages": orphans,
+            "vacuum": vacuum,
+            "duration_seconds": round(time.perf_counter() - started, 2)
+        }
+        logger.info(
+            f"🧹 Retention: {deleted} conversations, {orphans} orphan messages deleted, "
+            f"{vacuum['bytes_reclaimed'] / 1024 / 1024:.1f} MB reclaimed in {report['duration_seconds']}s")
+        return report
 
 
 # Singleton
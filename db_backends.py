@@ -0,0 +1,392 @@
+"""
+Storage backends for Database
+SQLite (default): pooled, pragma-tuned connections on a local file
+PostgreSQL (DATABASE_URL=postgresql://...): psycopg connection pool so several
+app machines can write to shared state, server-side cursors for exports and
+COPY for bulk loads. Database keeps writing SQLite-style SQL ("?" params,
+BEGIN IMMEDIATE); the PostgreSQL connection wrapper translates it
+"""
+
+import functools
+import logging
+import os
+import queue
+import sqlite3
+import uuid
+import zlib
+from datetime import date, datetime
+from decimal import Decimal
+
+logger = logging.getLogger(__name__)
+
+# ✅ SQLITE TUNING (applied on every pooled connection)
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", 16000))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", 64 * 1024 * 1024))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000))
+SQLITE_POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", 8))
+
+# ✅ POSTGRESQL POOL (per app process)
+POSTGRES_POOL_MIN = int(os.getenv("POSTGRES_POOL_MIN", 2))
+POSTGRES_POOL_MAX = int(os.getenv("POSTGRES_POOL_MAX", 10))
+POSTGRES_STATEMENT_TIMEOUT_MS = int(os.getenv("POSTGRES_STATEMENT_TIMEOUT_MS", 30000))
+
+
+def inflate(blob):
+    """SQL inflate(body_zlib): text of a zlib-compressed message (NULL stays NULL)"""
+    return zlib.decompress(blob).decode('utf-8') if blob is not None else None
+
+
+class PooledConnection(sqlite3.Connection):
+    """
+    Long-lived connection handed out by ConnectionPool
+    close() rolls back any unfinished transaction and returns it to the pool
+    """
+
+    pool = None
+
+    def close(self):
+        if self.in_transaction:
+            self.rollback()
+        if self.pool is None or not self.pool.release(self):
+            super().close()
+
+    def discard(self):
+        """Really close the underlying connection"""
+        super().close()
+
+
+class ConnectionPool:
+    """
+    Pool of pragma-tuned SQLite connections (WAL, synchronous=NORMAL)
+    Flask serves each request on its own thread, so connections are shared
+    across threads (one user at a time) instead of being thread-local
+    """
+
+    def __init__(self, db_path, read_only=False, max_idle=SQLITE_POOL_SIZE):
+        self.db_path = db_path
+        self.read_only = read_only
+        self._idle = queue.LifoQueue(maxsize=max_idle)
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=SQLITE_BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,
+            factory=PooledConnection
+        )
+        conn.row_factory = sqlite3.Row
+        if not self.read_only:
+            # Only takes effect on a brand-new file (before WAL / first table);
+            # existing files are converted by Database.enable_incremental_vacuum()
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        conn.execute("PRAGMA foreign_keys=ON")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        if self.read_only:
+            conn.execute("PRAGMA query_only=ON")
+        # Keyword search over compressed bot replies (LIKE fallback)
+        conn.create_function("inflate", 1, inflate, deterministic=True)
+        conn.pool = self
+        return conn
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def release(self, conn):
+        """Put connection back; False if the pool is full (caller closes it)"""
+        try:
+            self._idle.put_nowait(conn)
+            return True
+        except queue.Full:
+            return False
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().discard()
+            except queue.Empty:
+                return
+
+
+class SQLiteBackend:
+    """Local SQLite file (single writer, WAL readers)"""
+
+    name = "sqlite"
+    # Two-argument scalar max / case-insensitive match
+    GREATEST = "MAX"
+    ILIKE = "LIKE"
+    # Worth retrying: "database is locked" after busy_timeout, disk I/O hiccups
+    TRANSIENT_ERRORS = (sqlite3.OperationalError,)
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.pool = ConnectionPool(db_path)
+        self.read_pool = ConnectionPool(db_path, read_only=True)
+
+    def connect(self):
+        return self.pool.acquire()
+
+    def read_connect(self):
+        return self.read_pool.acquire()
+
+    def close(self):
+        self.pool.close_all()
+        self.read_pool.close_all()
+
+    def local_day(self, column):
+        """SQL for the local YYYY-MM-DD of a CURRENT_TIMESTAMP (UTC) column"""
+        return f"DATE({column}, 'localtime')"
+
+    def schema_version(self, cursor):
+        return cursor.execute("PRAGMA user_version").fetchone()[0]
+
+    def lock_schema(self, cursor):
+        """Serialize migrations across processes (BEGIN IMMEDIATE already does)"""
+
+    def set_schema_version(self, cursor, version):
+        # PRAGMA does not accept parameters; version is our own int
+        cursor.execute(f"PRAGMA user_version = {int(version)}")
+
+    def stream_cursor(self, conn):
+        """Cursor for large result sets read with fetchmany()"""
+        return conn.cursor()
+
+    def copy_rows(self, cursor, table, columns, rows):
+        """Bulk insert rows (iterable of tuples) inside the caller's transaction"""
+        placeholders = ", ".join("?" * len(columns))
+        cursor.executemany(
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})", rows)
+
+
+# =========================
+# POSTGRESQL
+# =========================
+
+@functools.lru_cache(maxsize=1024)
+def translate_sql(sql):
+    """SQLite-style parametrized statement -> psycopg statement
+
+    "?" placeholders become "%s" and every literal "%" is doubled
+    (psycopg only parses the query when parameters are passed)
+    """
+    out = []
+    quote = None
+    for ch in sql:
+        if quote:
+            if ch == quote:
+                quote = None
+        elif ch in ("'", '"'):
+            quote = ch
+        elif ch == "?":
+            out.append("%s")
+            continue
+        out.append("%%" if ch == "%" else ch)
+    return "".join(out)
+
+
+def _sqlite_value(value):
+    """PostgreSQL result value -> what the sqlite3 module would have returned"""
+    if isinstance(value, datetime):
+        return str(value)
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, memoryview):
+        return bytes(value)
+    return value
+
+
+class PgRow(tuple):
+    """sqlite3.Row look-alike: row[0], row['name'], dict(row), unpacking"""
+
+    def __new__(cls, index, values):
+        row = super().__new__(cls, (_sqlite_value(value) for value in values))
+        row._index = index
+        return row
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            key = self._index[key]
+        return tuple.__getitem__(self, key)
+
+    def keys(self):
+        return list(self._index)
+
+
+def _pg_row_factory(cursor):
+    index = {column.name: i for i, column in enumerate(cursor.description or ())}
+    return lambda values: PgRow(index, values)
+
+
+class PostgresCursor:
+    """sqlite3.Cursor look-alike over a psycopg cursor"""
+
+    def __init__(self, connection, cursor):
+        self.connection = connection
+        self._cursor = cursor
+
+    def execute(self, sql, params=()):
+        if sql.strip().upper() == "BEGIN IMMEDIATE":
+            # psycopg opens the transaction itself on the first statement
+            return self
+        if params:
+            self._cursor.execute(translate_sql(sql), tuple(params))
+        else:
+            self._cursor.execute(sql)
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        self._cursor.executemany(translate_sql(sql), list(seq_of_params))
+        return self
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchmany(self, size):
+        return self._cursor.fetchmany(size)
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def copy(self, statement):
+        return self._cursor.copy(statement)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def close(self):
+        self._cursor.close()
+
+
+class PostgresConnection:
+    """sqlite3.Connection look-alike; close() returns it to the psycopg pool"""
+
+    def __init__(self, backend, pool):
+        self.backend = backend
+        self._pool = pool
+        self._raw = pool.getconn()
+
+    def cursor(self, name=None):
+        cursor = self._raw.cursor(name=name, row_factory=_pg_row_factory) if name \
+            else self._raw.cursor(row_factory=_pg_row_factory)
+        return PostgresCursor(self, cursor)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+
+    @property
+    def in_transaction(self):
+        return self._raw.info.transaction_status != self.backend.psycopg.pq.TransactionStatus.IDLE
+
+    def commit(self):
+        self._raw.commit()
+
+    def rollback(self):
+        self._raw.rollback()
+
+    def create_function(self, *args, **kwargs):
+        raise NotImplementedError("SQL functions in Python are SQLite-only")
+
+    def close(self):
+        if self._raw is None:
+            return
+        if self.in_transaction:
+            self._raw.rollback()
+        self._pool.putconn(self._raw)
+        self._raw = None
+
+
+class PostgresBackend:
+    """Shared PostgreSQL server (DATABASE_URL), psycopg 3 + psycopg_pool"""
+
+    name = "postgres"
+    GREATEST = "GREATEST"
+    ILIKE = "ILIKE"
+
+    def __init__(self, database_url, min_size=POSTGRES_POOL_MIN, max_size=POSTGRES_POOL_MAX):
+        # Optional dependency: only needed when DATABASE_URL points at PostgreSQL
+        import psycopg
+        from psycopg_pool import ConnectionPool as PsycopgPool
+
+        self.psycopg = psycopg
+        # Lost connection, serialization failure, deadlock, statement timeout
+        self.TRANSIENT_ERRORS = (psycopg.OperationalError,)
+        self.database_url = database_url
+        options = f"-c statement_timeout={POSTGRES_STATEMENT_TIMEOUT_MS}"
+        self.pool = PsycopgPool(
+            database_url, min_size=min_size, max_size=max_size, open=True,
+            kwargs={"options": options}, name="write")
+        # Same split as SQLite: analytics/admin reads can never write
+        self.read_pool = PsycopgPool(
+            database_url, min_size=min_size, max_size=max_size, open=True,
+            kwargs={"options": options + " -c default_transaction_read_only=on"},
+            name="read")
+        logger.info(f"🐘 PostgreSQL pools ready ({min_size}-{max_size} connections each)")
+
+    def connect(self):
+        return PostgresConnection(self, self.pool)
+
+    def read_connect(self):
+        return PostgresConnection(self, self.read_pool)
+
+    def close(self):
+        self.pool.close()
+        self.read_pool.close()
+
+    def local_day(self, column):
+        """Timestamps default to LOCALTIMESTAMP here, already local"""
+        return f"to_char({column}, 'YYYY-MM-DD')"
+
+    def schema_version(self, cursor):
+        cursor.execute("SELECT to_regclass('db_meta') IS NOT NULL")
+        if not cursor.fetchone()[0]:
+            return 0
+        cursor.execute("SELECT value FROM db_meta WHERE key = 'schema_version'")
+        row = cursor.fetchone()
+        return int(row[0]) if row else 0
+
+    def lock_schema(self, cursor):
+        """Transaction-scoped advisory lock: one migrating machine at a time"""
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext('db_schema_migrations'))")
+
+    def set_schema_version(self, cursor, version):
+        cursor.execute("""
+            INSERT INTO db_meta (key, value) VALUES ('schema_version', ?)
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value
+        """, (str(int(version)),))
+
+    def stream_cursor(self, conn):
+        """Named (server-side) cursor: fetchmany() pulls batches from the server"""
+        return conn.cursor(name=f"stream_{uuid.uuid4().hex}")
+
+    def copy_rows(self, cursor, table, columns, rows):
+        """COPY ... FROM STDIN inside the caller's transaction"""
+        with cursor.copy(f"COPY {table} ({', '.join(columns)}) FROM STDIN") as copy:
+            for row in rows:
+                copy.write_row(row)
+
+
+def create_backend(db_path, database_url=None):
+    """PostgreSQL if database_url is a postgres:// URL, SQLite file otherwise"""
+    if database_url and database_url.startswith(("postgres://", "postgresql://")):
+        return PostgresBackend(database_url)
+    return SQLiteBackend(db_path)
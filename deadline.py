@@ -0,0 +1,62 @@
+"""
+Per-request latency budget for /api/chat
+Created in main.chat and passed down to ChatBot.get_response, product search
+and ExtendedAPI, so every outbound call uses min(own timeout, remaining budget)
+"""
+
+import logging
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class Deadline:
+    def __init__(self, budget_seconds):
+        self.budget = budget_seconds
+        self.started = time.monotonic()
+        self.expires_at = self.started + budget_seconds
+        self.stages = {}   # stage name -> ms consumed
+        self.skipped = []  # stages skipped for lack of budget
+
+    def remaining(self):
+        """Seconds left in the budget (never negative)"""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def timeout_for(self, own_timeout):
+        """Timeout for an outbound call: min(own timeout, remaining budget)"""
+        return min(own_timeout, self.remaining())
+
+    def can_afford(self, min_seconds):
+        """True if at least min_seconds remain"""
+        return self.remaining() >= min_seconds
+
+    def skip(self, stage_name):
+        """Record a stage skipped in favour of a cheaper fallback"""
+        self.skipped.append(stage_name)
+        logger.warning(
+            f"⏱️ Skipping '{stage_name}' - only {self.remaining():.2f}s of budget left")
+
+    @contextmanager
+    def stage(self, stage_name):
+        """Measure time spent in a stage"""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed_ms = (time.monotonic() - started) * 1000
+            self.stages[stage_name] = self.stages.get(stage_name, 0) + elapsed_ms
+
+    def report(self):
+        """Budget consumption per stage (returned with the chat response)"""
+        elapsed_ms = (time.monotonic() - self.started) * 1000
+        return {
+            "budget_ms": int(self.budget * 1000),
+            "elapsed_ms": int(elapsed_ms),
+            "remaining_ms": int(self.remaining() * 1000),
+            "stages": {name: int(ms) for name, ms in self.stages.items()},
+            "skipped": list(self.skipped)
+        }
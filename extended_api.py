@@ -1,23 +1,126 @@
 import requests
 import os
 import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
+from requests.adapters import HTTPAdapter
+from circuit_breaker import get_breaker
 
 logger = logging.getLogger(__name__)
 
+# Order status cache (seconds)
+ORDER_CACHE_TTL = int(os.getenv('ORDER_CACHE_TTL', 90))
+# Pending orders are refreshed in background while someone asked about them recently
+ORDER_REFRESH_AGE = int(os.getenv('ORDER_REFRESH_AGE', 60))
+ORDER_TRACKING_WINDOW = int(os.getenv('ORDER_TRACKING_WINDOW', 1800))
+ORDER_CACHE_MAX_ENTRIES = 1000
+
+# AWB / order states after which an order no longer changes. Whole words
+# only (with Romanian feminine endings): "Nelivrat" / "not delivered" are
+# still pending
+FINAL_ORDER_KEYWORDS = ('livrat', 'delivered', 'anulat', 'returnat')
+FINAL_ORDER_PATTERN = re.compile(
+    r"(?<!not )\b(?:" + "|".join(FINAL_ORDER_KEYWORDS) + r")[aă]?\b")
+
+# Circuit breaker: open after N failures/slow calls, probe again after cool-down
+API_TIMEOUT = 10
+# Don't start a call with less budget than this (request deadline)
+API_MIN_BUDGET = float(os.getenv('API_MIN_BUDGET', 1.0))
+API_BREAKER_FAILURES = int(os.getenv('API_BREAKER_FAILURES', 5))
+API_BREAKER_SLOW_CALL = float(os.getenv('API_BREAKER_SLOW_CALL', 5))
+API_BREAKER_RESET = int(os.getenv('API_BREAKER_RESET', 30))
+
+# Bulk order lookups (admin): parallel requests over the pooled connection
+BULK_ORDER_WORKERS = int(os.getenv('BULK_ORDER_WORKERS', 8))
+
 
 class ExtendedAPI:
     def __init__(self):
         self.api_key = os.getenv('EXTENDED_API_KEY')
         self.base_url = "https://ejolie.ro/api/"
 
-    def search_products_exact(self, query, limit=10, category=None):
+        # 🔌 Pooled keep-alive connections to ejolie.ro
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1,
+                              pool_maxsize=max(10, BULK_ORDER_WORKERS))
+        self.http.mount('https://', adapter)
+
+        # 🎯 Order cache: order_id -> {data, fetched_at, last_access}
+        self._order_cache = {}
+        # Lookups in flight: order_id -> {event, result}
+        self._order_inflight = {}
+        self._order_lock = threading.Lock()
+
+        # ⚡ Fail fast when ejolie.ro API is degraded
+        self.breaker = get_breaker(
+            'extended_api',
+            failure_threshold=API_BREAKER_FAILURES,
+            slow_call_threshold=API_BREAKER_SLOW_CALL,
+            reset_timeout=API_BREAKER_RESET
+        )
+
+    def is_available(self):
+        """False while the circuit is open (API considered down)"""
+        return self.breaker.state != self.breaker.OPEN
+
+    def _api_get(self, params, headers, deadline=None):
+        """GET on the platform API through the circuit breaker
+
+        Args:
+            deadline: Optional request Deadline - timeout becomes
+                min(API_TIMEOUT, remaining budget)
+
+        Returns:
+            Response, or None if the circuit is open or the budget is
+            exhausted (caller falls back)
+        """
+        timeout = API_TIMEOUT
+        if deadline is not None:
+            timeout = deadline.timeout_for(API_TIMEOUT)
+            if timeout < API_MIN_BUDGET:
+                deadline.skip('extended_api')
+                return None
+
+        if not self.breaker.allow_request():
+            logger.warning("⚡ Extended API circuit OPEN - skipping call")
+            return None
+
+        started = time.monotonic()
+        try:
+            response = self.http.get(
+                self.base_url,
+                params=params,
+                headers=headers,
+                timeout=timeout
+            )
+        except requests.exceptions.Timeout:
+            if timeout < API_TIMEOUT:
+                # Cut short by our own deadline - not the API's fault
+                self.breaker.record_ignored()
+            else:
+                self.breaker.record_failure()
+            raise
+        except requests.exceptions.RequestException:
+            self.breaker.record_failure()
+            raise
+
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success(time.monotonic() - started)
+        return response
+
+    def search_products_exact(self, query, limit=10, category=None, deadline=None):
         """Search products with EXACT MATCH using platform API
 
         Args:
             query: Search query (e.g., "marina", "veda")
             limit: Max number of results
             category: Optional category filter
+            deadline: Optional request Deadline
 
         Returns:
             List of products matching exact query
@@ -47,12 +150,9 @@ class ExtendedAPI:
                 'Accept': 'application/json'
             }
 
-            response = requests.get(
-                self.base_url,
-                params=params,
-                headers=headers,
-                timeout=10
-            )
+            response = self._api_get(params, headers, deadline)
+            if response is None:
+                return None
 
             logger.info(f"📡 API Response status: {response.status_code}")
 
@@ -104,7 +204,7 @@ class ExtendedAPI:
             return None
 
     def search_products_fuzzy(self, query, limit=10, category=None,
-                              price_min=None, price_max=None):
+                              price_min=None, price_max=None, deadline=None):
         """Search products with FUZZY MATCH (similarity search)
 
         Args:
@@ -113,6 +213,7 @@ class ExtendedAPI:
             category: Optional category filter
             price_min: Min price filter
             price_max: Max price filter
+            deadline: Optional request Deadline
 
         Returns:
             List of products matching fuzzy query
@@ -145,12 +246,9 @@ class ExtendedAPI:
                 'Accept': 'application/json'
             }
 
-            response = requests.get(
-                self.base_url,
-                params=params,
-                headers=headers,
-                timeout=10
-            )
+            response = self._api_get(params, headers, deadline)
+            if response is None:
+                return None
 
             if response.status_code != 200:
                 logger.error(f"❌ API error: {response.status_code}")
@@ -190,11 +288,21 @@ class ExtendedAPI:
             logger.error(f"❌ Error in fuzzy search: {e}")
             return None
 
-    def get_order_status(self, order_id):
+    def get_order_status(self, order_id, deadline=None):
         """Get order status and details from Extended API"""
+        return self._request_order(order_id, deadline)[0]
+
+    def _request_order(self, order_id, deadline=None):
+        """Order lookup on the API
+
+        Returns:
+            (order_data or None, answered): answered is False when the API
+            gave no verdict (budget spent, circuit open, timeout, error),
+            so None only means "not found" when answered is True
+        """
         if not self.api_key:
             logger.error("❌ EXTENDED_API_KEY not configured")
-            return None
+            return None, False
 
         try:
             params = {
@@ -211,12 +319,9 @@ class ExtendedAPI:
                 'Accept': 'application/json'
             }
 
-            response = requests.get(
-                self.base_url,
-                params=params,
-                headers=headers,
-                timeout=10
-            )
+            response = self._api_get(params, headers, deadline)
+            if response is None:
+                return None, False
 
             # Log response for debugging
             logger.info(f"📡 API Response status: {response.status_code}")
@@ -225,14 +330,14 @@ class ExtendedAPI:
 
             if response.status_code != 200:
                 logger.error(f"❌ API error: {response.status_code}")
-                return None
+                return None, False
 
             data = response.json()
 
-            # Check for API errors
+            # Check for API errors (the API's answer for an unknown order)
             if isinstance(data, dict) and data.get('eroare') == 1:
                 logger.error(f"❌ Extended API error: {data.get('mesaj')}")
-                return None
+                return None, True
 
             # Extract order data (API returns dict with order_id as key)
             # Try both string and integer keys
@@ -245,29 +350,189 @@ class ExtendedAPI:
 
             if order:
                 logger.info(f"✅ Order #{order_id} found")
-                return self._format_order_data(order)
+                return self._format_order_data(order), True
 
             logger.warning(f"⚠️ Order #{order_id} not found in response")
             logger.info(
                 f"📋 Response keys: {list(data.keys()) if isinstance(data, dict) else 'not a dict'}")
-            return None
+            return None, True
 
         except requests.exceptions.Timeout:
             logger.error("❌ API request timeout")
-            return None
+            return None, False
         except requests.exceptions.RequestException as e:
             logger.error(f"❌ API request error: {e}")
-            return None
+            return None, False
         except Exception as e:
             logger.error(f"❌ Unexpected error: {e}")
-            return None
+            return None, False
+
+    # =========================
+    # ORDER CACHE (single-flight)
+    # =========================
+    def get_order_status_cached(self, order_id, deadline=None, track=True):
+        """Get order status from memory if fresh, otherwise fetch it once
+
+        Concurrent lookups for the same order share a single API call.
+        track=False (admin bulk checks) leaves last_access alone, so the
+        order is not kept refreshed by refresh_pending_orders.
+        """
+        return self.lookup_order(order_id, deadline, track)[0]
+
+    def lookup_order(self, order_id, deadline=None, track=True):
+        """get_order_status_cached that also says whether the API answered
+
+        Returns:
+            (order_data or None, answered) - see _request_order
+        """
+        order_id = str(order_id).strip()
+        now = time.time()
+
+        with self._order_lock:
+            entry = self._order_cache.get(order_id)
+            if entry and now - entry['fetched_at'] < ORDER_CACHE_TTL:
+                if track:
+                    entry['last_access'] = now
+                logger.info(f"💨 Order #{order_id} served from cache")
+                return entry['data'], True
+
+        return self._fetch_order_single_flight(order_id, deadline, track=track)
+
+    def _fetch_order_single_flight(self, order_id, deadline=None, track=True):
+        """Fetch order from API, joining a lookup already in flight
+
+        track=True marks the order as asked about now (last_access);
+        otherwise an existing last_access is kept (0 = never asked)
 
-    def get_user_info(self, session_token=None, user_cookie=None):
+        Returns:
+            (order_data or None, answered) - see _request_order
+        """
+        with self._order_lock:
+            flight = self._order_inflight.get(order_id)
+            is_leader = flight is None
+            if is_leader:
+                flight = {'event': threading.Event(), 'result': None, 'answered': False}
+                self._order_inflight[order_id] = flight
+
+        if not is_leader:
+            logger.info(f"⏳ Order #{order_id} lookup already in flight - waiting")
+            wait = API_TIMEOUT if deadline is None else deadline.timeout_for(API_TIMEOUT)
+            finished = flight['event'].wait(timeout=wait)
+            if track:
+                # The leader may have been an untracked (bulk/refresh) lookup
+                with self._order_lock:
+                    entry = self._order_cache.get(order_id)
+                    if entry:
+                        entry['last_access'] = time.time()
+            return flight['result'], finished and flight['answered']
+
+        data, answered = None, False
+        try:
+            data, answered = self._request_order(order_id, deadline)
+        finally:
+            now = time.time()
+            with self._order_lock:
+                if data:
+                    previous = self._order_cache.get(order_id)
+                    self._order_cache[order_id] = {
+                        'data': data,
+                        'fetched_at': now,
+                        'last_access': now if track else (previous['last_access'] if previous else 0)
+                    }
+                    self._evict_orders_locked()
+                flight['result'] = data
+                flight['answered'] = answered
+                self._order_inflight.pop(order_id, None)
+            flight['event'].set()
+
+        return data, answered
+
+    def get_orders_status_bulk(self, order_ids, max_workers=BULK_ORDER_WORKERS):
+        """Look up many orders with bounded parallelism (admin bulk check)
+
+        Reuses the order cache / single-flight path, so orders already asked
+        about in chat are not fetched again. Lookups are untracked: a bulk
+        check does not make refresh_pending_orders poll these orders.
+
+        Args:
+            order_ids: Iterable of order ids (duplicates ignored)
+            max_workers: Max concurrent API calls
+
+        Yields:
+            (order_id, order_data or None, answered) as soon as each lookup
+            finishes; answered=False means the API did not give an answer
+            (circuit open, timeout, error), not that the order is missing
+        """
+        unique_ids = list(dict.fromkeys(
+            str(order_id).strip() for order_id in order_ids if str(order_id).strip()))
+        if not unique_ids:
+            return
+
+        logger.info(
+            f"📦 Bulk order lookup: {len(unique_ids)} orders ({max_workers} workers)")
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(self.lookup_order, order_id, track=False): order_id
+                for order_id in unique_ids
+            }
+            for future in as_completed(futures):
+                order_id = futures[future]
+                try:
+                    order_data, answered = future.result()
+                    yield order_id, order_data, answered
+                except Exception as e:
+                    logger.error(f"❌ Bulk lookup error for #{order_id}: {e}")
+                    yield order_id, None, False
+
+    def _evict_orders_locked(self):
+        """Drop least recently asked orders when cache is full (lock held)"""
+        overflow = len(self._order_cache) - ORDER_CACHE_MAX_ENTRIES
+        if overflow <= 0:
+            return
+        oldest = sorted(self._order_cache.items(),
+                        key=lambda item: item[1]['last_access'])[:overflow]
+        for order_id, _ in oldest:
+            self._order_cache.pop(order_id, None)
+
+    def is_order_final(self, order_data):
+        """True if order was delivered/cancelled (status won't change)"""
+        if not order_data:
+            return True
+        states = f"{order_data.get('awb_status') or ''} {order_data.get('status') or ''}".lower()
+        return FINAL_ORDER_PATTERN.search(states) is not None
+
+    def refresh_pending_orders(self):
+        """Background job: refresh cached orders whose AWB is not delivered yet"""
+        now = time.time()
+        to_refresh = []
+
+        with self._order_lock:
+            for order_id, entry in list(self._order_cache.items()):
+                recently_asked = now - entry['last_access'] < ORDER_TRACKING_WINDOW
+                if self.is_order_final(entry['data']) or not recently_asked:
+                    # Nobody waits on it anymore - keep only until TTL expires
+                    if now - entry['fetched_at'] >= ORDER_CACHE_TTL:
+                        self._order_cache.pop(order_id, None)
+                    continue
+                if now - entry['fetched_at'] >= ORDER_REFRESH_AGE:
+                    to_refresh.append(order_id)
+
+        if not to_refresh:
+            return 0
+
+        logger.info(f"🔄 Refreshing {len(to_refresh)} pending orders")
+        for order_id in to_refresh:
+            self._fetch_order_single_flight(order_id, track=False)
+        return len(to_refresh)
+
+    def get_user_info(self, session_token=None, user_cookie=None, deadline=None):
         """Get logged-in user information from Extended API
 
         Args:
             session_token: Session token from cookie
             user_cookie: Full cookie string
+            deadline: Optional request Deadline
 
         Returns:
             Dict with user info: {user_id, name, email} or None
@@ -295,12 +560,9 @@ class ExtendedAPI:
 
             logger.info(f"🔍 Fetching user info from Extended API")
 
-            response = requests.get(
-                self.base_url,
-                params=params,
-                headers=headers,
-                timeout=10
-            )
+            response = self._api_get(params, headers, deadline)
+            if response is None:
+                return None
 
             logger.info(f"📡 API Response status: {response.status_code}")
 
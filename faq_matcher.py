@@ -11,6 +11,45 @@ from typing import Dict, List, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
+# Mapare diacritice românești
+DIACRITICS_MAP = str.maketrans({
+    'ă': 'a', 'â': 'a', 'î': 'i', 'ș': 's', 'ț': 't',
+    'Ă': 'a', 'Â': 'a', 'Î': 'i', 'Ș': 's', 'Ț': 't'
+})
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalizare comună (FAQ matching + statistici întrebări):
+    - Lowercase
+    - Elimină diacritice (ă→a, î→i, ș→s, ț→t)
+    - Elimină punctuație
+    - Elimină spații multiple
+
+    Args:
+        text: Textul de procesat
+
+    Returns:
+        str: Textul procesat
+    """
+    if not text:
+        return ""
+
+    # Lowercase
+    text = text.lower()
+
+    # Elimină diacritice
+    text = text.translate(DIACRITICS_MAP)
+
+    # Elimină punctuație (păstrăm doar litere și cifre)
+    text = re.sub(r'[^\w\s]', ' ', text)
+
+    # Elimină spații multiple
+    text = re.sub(r'\s+', ' ', text)
+
+    # Trim
+    return text.strip()
+
 
 class FAQMatcher:
     """
@@ -33,10 +72,7 @@ class FAQMatcher:
         self.cache = {}  # Cache pentru matching rapid
 
         # Mapare diacritice românești
-        self.diacritics_map = str.maketrans({
-            'ă': 'a', 'â': 'a', 'î': 'i', 'ș': 's', 'ț': 't',
-            'Ă': 'a', 'Â': 'a', 'Î': 'i', 'Ș': 's', 'Ț': 't'
-        })
+        self.diacritics_map = DIACRITICS_MAP
 
         logger.info(
             f"✅ FAQ Matcher initialized with {len(self.faq_data.get('categorii', []))} categories")
@@ -56,11 +92,7 @@ class FAQMatcher:
 
     def process_text(self, text: str) -> str:
         """
-        Procesează textul pentru matching:
-        - Lowercase
-        - Elimină diacritice (ă→a, î→i, ș→s, ț→t)
-        - Elimină punctuație
-        - Elimină spații multiple
+        Procesează textul pentru matching (vezi normalize_text).
 
         Args:
             text: Textul de procesat
@@ -68,25 +100,7 @@ class FAQMatcher:
         Returns:
             str: Textul procesat
         """
-        if not text:
-            return ""
-
-        # Lowercase
-        text = text.lower()
-
-        # Elimină diacritice
-        text = text.translate(self.diacritics_map)
-
-        # Elimină punctuație (păstrăm doar litere și cifre)
-        text = re.sub(r'[^\w\s]', ' ', text)
-
-        # Elimină spații multiple
-        text = re.sub(r'\s+', ' ', text)
-
-        # Trim
-        text = text.strip()
-
-        return text
+        return normalize_text(text)
 
     def calculate_similarity(self, text1: str, text2: str) -> float:
         """
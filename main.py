@@ -7,7 +7,7 @@ import traceback
 from datetime import datetime, timedelta
 
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify, render_template, send_from_directory, session, redirect, url_for
+from flask import Flask, Response, request, jsonify, render_template, send_from_directory, session, redirect, url_for, stream_with_context
 from flask_session import Session  # ✅ NEW: Flask-Session
 from flask_cors import CORS  # ✅ NEW: CORS support
 from flask_limiter import Limiter
@@ -16,10 +16,15 @@ from werkzeug.middleware.proxy_fix import ProxyFix
 from apscheduler.schedulers.background import BackgroundScheduler
 from functools import wraps  # ✅ NEW: For decorators
 
-from analytics_api import setup_analytics_routes
+from analytics_api import result_cache, setup_analytics_routes
+from analytics_replica import ANALYTICS_REPLICA_INTERVAL, analytics_replica
 from sync_feed import sync_products_from_feed
 from chatbot import bot
 from database import db
+from conversation_writer import conversation_writer
+from extended_api import extended_api
+from circuit_breaker import breakers_snapshot
+from deadline import Deadline
 
 load_dotenv()
 
@@ -93,6 +98,12 @@ ADMIN_PASSWORD = os.environ.get("ADMIN_PASSWORD", "admin123")
 if ADMIN_PASSWORD == "admin123":
     logger.warning("⚠️ SECURITY WARNING: Using default admin password!")
 
+# ⏱️ Overall latency budget for one /api/chat request (seconds)
+CHAT_DEADLINE_SECONDS = float(os.environ.get("CHAT_DEADLINE_SECONDS", 20))
+
+# 📦 Max orders per bulk status request (admin)
+BULK_ORDER_MAX = int(os.environ.get("BULK_ORDER_MAX", 500))
+
 # ==================== AUTH DECORATORS ====================
 
 
@@ -141,6 +152,13 @@ def do_sync():
     return False
 
 
+def initial_sync():
+    """Startup feed sync, skipped if the last logged sync is < 6h old
+    (runs as a scheduler job so importing database stays cheap)"""
+    if db.should_sync_from_feed(tenant_id="default", hours=6) and db.ensure_initial_sync():
+        bot.load_products()
+
+
 logger.info("🚀 Starting Ejolie ChatBot Server...")
 
 if not os.path.exists("products.csv"):
@@ -155,8 +173,45 @@ else:
 
 scheduler = BackgroundScheduler()
 scheduler.add_job(do_sync, "interval", hours=6, id="product_sync")
+# 📦 Keep cached orders with undelivered AWB fresh
+scheduler.add_job(extended_api.refresh_pending_orders, "interval",
+                  seconds=int(os.environ.get("ORDER_REFRESH_SECONDS", 60)),
+                  id="order_refresh", max_instances=1, coalesce=True)
+# 📥 One-off feed sync check after startup (products.csv is loaded above)
+scheduler.add_job(initial_sync, id="initial_sync", max_instances=1)
+# 🔎 Index messages that predate the full-text search table (runs once, chunked)
+scheduler.add_job(db.backfill_message_search_index, id="fts_backfill",
+                  max_instances=1)
+# 🗄️ Nightly archive: conversations idle > ARCHIVE_AFTER_DAYS (0 = off) move to
+# monthly .jsonl.gz files; runs before retention so the vacuum reclaims the space
+if int(os.environ.get("ARCHIVE_AFTER_DAYS", 0)) > 0:
+    scheduler.add_job(db.archive_old_conversations, "cron",
+                      hour=int(os.environ.get("ARCHIVE_HOUR", 2)),
+                      kwargs={"days": int(os.environ["ARCHIVE_AFTER_DAYS"])},
+                      id="archive", max_instances=1, coalesce=True)
+# 🧹 Nightly retention: old conversations (RETENTION_DAYS, 0 = keep all),
+# orphaned messages, then incremental vacuum
+scheduler.add_job(db.run_retention, "cron",
+                  hour=int(os.environ.get("RETENTION_HOUR", 3)),
+                  kwargs={"days": int(os.environ.get("RETENTION_DAYS", 0))},
+                  id="retention", max_instances=1, coalesce=True)
+# 📊 Admin dashboards/exports read a periodic copy (ANALYTICS_REPLICA_PATH)
+if analytics_replica is not None:
+    scheduler.add_job(analytics_replica.refresh, "interval",
+                      seconds=ANALYTICS_REPLICA_INTERVAL, next_run_time=datetime.now(),
+                      id="analytics_replica", max_instances=1, coalesce=True)
 scheduler.start()
 
+# ✍️ Conversations are written in background batches (group commit)
+conversation_writer.start()
+
+# 🏷️ Tenant api_key lookups are served from memory (TTL refresh + on create_tenant)
+try:
+    db.tenants.load()
+except Exception:
+    logger.warning("⚠️ Could not load tenants at startup (loaded on first request):")
+    logger.warning(traceback.format_exc())
+
 setup_analytics_routes(app)
 
 # ==================== AUTH ROUTES ====================
@@ -282,7 +337,12 @@ def health():
         "status": "healthy",
         "products_loaded": len(getattr(bot, "products", [])),
         "timestamp": datetime.now().isoformat(),
-        "scheduler_running": bool(scheduler.running)
+        "scheduler_running": bool(scheduler.running),
+        "circuit_breakers": breakers_snapshot(),
+        "conversation_writer": conversation_writer.metrics(),
+        "tenant_registry": db.tenants.metrics(),
+        "analytics_replica": analytics_replica.metrics() if analytics_replica else None,
+        "analytics_cache": result_cache.metrics()
     }), 200
 
 # ==================== CHAT API ====================
@@ -292,6 +352,7 @@ def health():
 @limiter.limit("30 per minute")
 def chat():
     """Chat API - NO LOGIN REQUIRED - public access for widget"""
+    deadline = Deadline(CHAT_DEADLINE_SECONDS)
     try:
         logger.info(
             f"Chat request from {request.remote_addr} - Origin: {request.headers.get('Origin', 'N/A')}")
@@ -325,9 +386,9 @@ def chat():
                 'PHPSESSID')  # Adjust cookie name if different
 
             if session_cookie:
-                from extended_api import extended_api
-                user_info = extended_api.get_user_info(
-                    session_token=session_cookie)
+                with deadline.stage('user_info'):
+                    user_info = extended_api.get_user_info(
+                        session_token=session_cookie, deadline=deadline)
 
                 if user_info:
                     logger.info(
@@ -347,7 +408,8 @@ def chat():
             user_message,
             session_id=session_id,
             user_ip=request.remote_addr,
-            user_agent=request.headers.get("User-Agent", "")
+            user_agent=request.headers.get("User-Agent", ""),
+            deadline=deadline
         )
 
         if isinstance(response, str):
@@ -362,23 +424,35 @@ def chat():
 
         # =========================
         # SAVE CONVERSATION (with user info if available)
+        # Queued - written in background, response doesn't wait for disk
+        # Stored with the total / per-stage times measured so far
         # ===========================
+        # Template/FAQ replies are stored by reference (not sent to the widget)
+        response_template = response.pop("template_id", None)
         try:
-            db.save_conversation(
-                session_id=session_id or f"session_{int(datetime.now().timestamp())}",
-                user_message=user_message,
-                bot_response=response.get("response", ""),
-                user_ip=request.remote_addr,
-                user_agent=request.headers.get("User-Agent", ""),
-                user_id=user_info.get('user_id') if user_info else None,
-                user_name=user_info.get('name') if user_info else None,
-                user_email=user_info.get('email') if user_info else None,
-                tenant_id=tenant_id
-            )
+            answer_timings = deadline.report()
+            with deadline.stage('db'):
+                conversation_writer.submit(
+                    session_id=session_id or f"session_{int(datetime.now().timestamp())}",
+                    user_message=user_message,
+                    bot_response=response.get("response", ""),
+                    user_ip=request.remote_addr,
+                    user_agent=request.headers.get("User-Agent", ""),
+                    user_id=user_info.get('user_id') if user_info else None,
+                    user_name=user_info.get('name') if user_info else None,
+                    user_email=user_info.get('email') if user_info else None,
+                    tenant_id=tenant_id,
+                    response_time_ms=answer_timings["elapsed_ms"],
+                    timings=answer_timings,
+                    response_template=response_template
+                )
         except Exception:
             logger.warning("⚠️ Failed to save conversation:")
             logger.warning(traceback.format_exc())
 
+        # ⏱️ Budget consumed per stage
+        response["timings"] = deadline.report()
+
         if response.get("status") == "rate_limited":
             return jsonify(response), 429
 
@@ -519,6 +593,47 @@ def sync_feed():
         return jsonify({"error": "Feed sync error"}), 500
 
 
+# ==================== ORDERS (ADMIN) ====================
+
+@app.route("/api/admin/orders/bulk-status", methods=["POST"])
+@require_admin  # ✅ REQUIRE ADMIN SESSION
+@limiter.limit("10 per minute")
+def bulk_order_status():
+    """Check many orders at once - streams one JSON line per order (NDJSON)"""
+    data = request.get_json(silent=True) or {}
+    order_ids = data.get("order_ids") or []
+    if isinstance(order_ids, str):
+        order_ids = order_ids.replace("\n", ",").split(",")
+
+    order_ids = [str(order_id).strip().lstrip("#") for order_id in order_ids]
+    order_ids = [order_id for order_id in order_ids if order_id]
+
+    if not order_ids:
+        return jsonify({"error": "Niciun număr de comandă"}), 400
+    if len(order_ids) > BULK_ORDER_MAX:
+        return jsonify({"error": f"Maxim {BULK_ORDER_MAX} comenzi per cerere"}), 400
+    invalid = [order_id for order_id in order_ids if not order_id.isdigit()]
+    if invalid:
+        return jsonify({"error": "Numere de comandă invalide", "invalid": invalid[:20]}), 400
+
+    logger.info(f"📦 Bulk order status: {len(order_ids)} orders")
+
+    def generate():
+        for order_id, order_data, answered in extended_api.get_orders_status_bulk(order_ids):
+            line = {"order_id": order_id, "found": bool(order_data)}
+            if order_data:
+                line["order"] = order_data
+                line["response"] = bot.format_order_response(order_data)
+            elif not answered:
+                # No answer (timeout / error / circuit open) is not "not found"
+                line["error"] = "lookup_failed"
+                if not extended_api.is_available():
+                    line["reason"] = "api_unavailable"
+            yield json.dumps(line, ensure_ascii=False, default=str) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
 # ==================== SYNC HISTORY ====================
 
 @app.route('/api/admin/sync-history', methods=['GET'])
@@ -526,7 +641,7 @@ def sync_feed():
 def sync_history():
     """Get sync history from database"""
     try:
-        conn = db.get_connection()
+        conn = db.get_read_connection()
         cursor = conn.cursor()
         cursor.execute("""
             SELECT id, last_sync, products_count, status, error_message 
@@ -575,6 +690,10 @@ def server_error(e):
 def shutdown_scheduler():
     if scheduler.running:
         scheduler.shutdown()
+    conversation_writer.stop()
+    if analytics_replica is not None:
+        analytics_replica.close()
+    db.close()
 
 
 atexit.register(shutdown_scheduler)
@@ -1,7 +1,10 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """
-Database migration script to add password_hash column
+Database migration script
+Applies pending schema migrations (Database.MIGRATIONS, tracked with
+PRAGMA user_version). The same runner executes on every startup; this
+script runs it explicitly and reports the versions (e.g. before a deploy)
 """
 
 import sqlite3
@@ -11,43 +14,31 @@ DATABASE_PATH = os.getenv("DATABASE_PATH", "chat_database.db")
 
 
 def migrate_database():
-    """Add password_hash column to users table"""
+    """Bring the database schema to the latest version"""
 
     print("=" * 60)
     print("Database Migration Script")
     print("=" * 60)
     print()
 
-    if not os.path.exists(DATABASE_PATH):
-        print(f"[INFO] Database not found at {DATABASE_PATH}")
-        print("[INFO] No migration needed - will be created with correct schema")
-        return True
-
     try:
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-
-        # Check if password_hash column exists
-        cursor.execute("PRAGMA table_info(users)")
-        columns = [row[1] for row in cursor.fetchall()]
-
-        if 'password_hash' in columns:
-            print("[INFO] Column 'password_hash' already exists")
-            print("[SUCCESS] No migration needed")
+        before = 0
+        if os.path.exists(DATABASE_PATH):
+            conn = sqlite3.connect(DATABASE_PATH)
+            before = conn.execute("PRAGMA user_version").fetchone()[0]
             conn.close()
-            return True
-
-        # Add password_hash column
-        print("[INFO] Adding 'password_hash' column to users table...")
-        cursor.execute("""
-            ALTER TABLE users
-            ADD COLUMN password_hash TEXT
-        """)
+        else:
+            print(f"[INFO] Database not found at {DATABASE_PATH} - creating it")
 
-        conn.commit()
-        conn.close()
+        # Importing database runs pending migrations on DATABASE_PATH
+        from database import db
+        after = db.get_schema_version()
 
-        print("[SUCCESS] Migration complete!")
+        if after == before:
+            print(f"[INFO] Schema already at version {after}")
+            print("[SUCCESS] No migration needed")
+        else:
+            print(f"[SUCCESS] Migrated schema from version {before} to {after}")
         print("=" * 60)
         return True
 
@@ -0,0 +1,167 @@
+"""
+In-memory tenant registry for API-key authenticated requests
+All tenants are loaded once (then every TENANT_CACHE_TTL seconds, and right
+after create_tenant) so resolving an api_key is a dict lookup; unknown keys
+are remembered for TENANT_NEGATIVE_TTL so invalid-key floods stay off the DB.
+Once the TTL expires, requests keep the previous snapshot while a single
+background thread reloads it
+"""
+
+import hashlib
+import hmac
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+TENANT_CACHE_TTL = int(os.getenv("TENANT_CACHE_TTL", 300))
+TENANT_NEGATIVE_TTL = int(os.getenv("TENANT_NEGATIVE_TTL", 60))
+TENANT_NEGATIVE_CACHE_SIZE = int(os.getenv("TENANT_NEGATIVE_CACHE_SIZE", 10000))
+
+
+def _key_digest(api_key):
+    """Dict key for an api_key (the raw key is only compared, never hashed on)"""
+    return hashlib.sha256(api_key.encode("utf-8")).digest()
+
+
+class TenantRegistry:
+    def __init__(self, database, ttl=TENANT_CACHE_TTL, negative_ttl=TENANT_NEGATIVE_TTL,
+                 max_negative=TENANT_NEGATIVE_CACHE_SIZE):
+        self.database = database
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_negative = max_negative
+        self._tenants = {}      # sha256(api_key) -> tenant row dict
+        self._unknown = {}      # sha256(api_key) -> expires_at (monotonic)
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()   # one load at a time
+        self._refreshing = False
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.db_lookups = 0
+        self.loads = 0
+
+    def load(self):
+        """(Re)load every tenant from the database
+
+        Returns:
+            int: Number of tenants loaded
+        """
+        with self._load_lock:
+            return self._load()
+
+    def _load(self):
+        conn = self.database.get_read_connection()
+        try:
+            rows = conn.execute("SELECT * FROM tenants").fetchall()
+        finally:
+            conn.close()
+
+        tenants = {_key_digest(row["api_key"]): dict(row) for row in rows}
+        with self._lock:
+            self._tenants = tenants
+            self._unknown = {}
+            self._expires_at = time.monotonic() + self.ttl
+            self.loads += 1
+        logger.info(f"🏷️ Tenant registry loaded ({len(tenants)} tenants)")
+        return len(tenants)
+
+    def add(self, tenant):
+        """Register a tenant created by this process (no reload needed)"""
+        digest = _key_digest(tenant["api_key"])
+        with self._lock:
+            self._tenants[digest] = dict(tenant)
+            self._unknown.pop(digest, None)
+
+    def _ensure_fresh(self):
+        """Load on first use; afterwards refresh an expired snapshot in the
+        background (single-flight) and keep serving the old one meanwhile"""
+        if time.monotonic() < self._expires_at:
+            return
+
+        if not self.loads:
+            # Nothing to serve yet: load here, concurrent requests wait for it
+            with self._load_lock:
+                if not self.loads:
+                    self._reload()
+            return
+
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh, name="tenant-registry-refresh",
+                         daemon=True).start()
+
+    def _refresh(self):
+        try:
+            with self._load_lock:
+                if time.monotonic() >= self._expires_at:
+                    self._reload()
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def _reload(self):
+        try:
+            self._load()
+        except Exception as e:
+            # Keep serving the previous snapshot; retry on the next request
+            logger.error(f"❌ Tenant registry reload failed: {e}")
+
+    def resolve(self, api_key):
+        """Tenant dict for an api_key, or None if the key is invalid
+
+        Keys missing from the registry are looked up once in the database
+        (tenants created by another process since the last load), then
+        cached as unknown for negative_ttl seconds.
+        """
+        if not api_key:
+            return None
+        self._ensure_fresh()
+
+        digest = _key_digest(api_key)
+        tenant = self._tenants.get(digest)
+        if tenant is not None:
+            if hmac.compare_digest(tenant["api_key"].encode("utf-8"), api_key.encode("utf-8")):
+                self.hits += 1
+                return tenant
+            return None
+
+        now = time.monotonic()
+        expires_at = self._unknown.get(digest)
+        if expires_at is not None and expires_at > now:
+            self.misses += 1
+            return None
+
+        self.db_lookups += 1
+        tenant = self.database.find_tenant_by_api_key(api_key)
+        if tenant is not None:
+            self.add(tenant)
+            return tenant
+
+        self.misses += 1
+        with self._lock:
+            if len(self._unknown) >= self.max_negative:
+                self._unknown = {k: v for k, v in self._unknown.items() if v > now}
+                if len(self._unknown) >= self.max_negative:
+                    self._unknown.clear()
+            self._unknown[digest] = now + self.negative_ttl
+        return None
+
+    def metrics(self):
+        """Registry size and hit counters (for /health)"""
+        return {
+            "tenants": len(self._tenants),
+            "unknown_keys_cached": len(self._unknown),
+            "hits": self.hits,
+            "misses": self.misses,
+            "db_lookups": self.db_lookups,
+            "loads": self.loads,
+            "refresh_in_seconds": max(0, round(self._expires_at - time.monotonic(), 1))
+        }